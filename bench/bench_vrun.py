@@ -0,0 +1,214 @@
+"""
+File: bench_vrun.py
+Author: Ser_Lip
+Description: Scale benchmarks of vrun's own overhead, with the fake
+    vlogan/vcs/simv of bench/bin standing in for VCS.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import random
+import argparse
+import tempfile
+import subprocess
+import yaml
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+vrunPath = os.path.join(os.path.dirname(benchDir), "vrun.py")
+
+
+def parseArgs():
+    """
+    Create a command line parser.
+
+    Returns:
+        args : command line parser.
+    """
+    parser = argparse.ArgumentParser(description="Measure vrun overhead at scale with a fake simulator.")
+    parser.add_argument("--tests", type=int, default=2000, help="Number of tests in the config.")
+    parser.add_argument("--depth", type=int, default=20, help="Length of the extends chains.")
+    parser.add_argument("--files", type=int, default=8, help="Number of imported test YAML files.")
+    parser.add_argument("--nest", type=int, default=4, help="Import nesting depth of the test YAML files.")
+    parser.add_argument("--regr_entries", type=int, default=200, help="Entries of the regression list.")
+    parser.add_argument("--iterations", type=int, default=2, help="Iterations of every regression entry.")
+    parser.add_argument("--jobs", type=int, default=8, help="vrun -j for the regression.")
+    parser.add_argument("--sim_time", type=float, default=0.05, help="Seconds every fake simulation takes.")
+    parser.add_argument("--compile_time", type=float, default=0.1, help="Seconds every fake compile step takes.")
+    parser.add_argument("--log_lines", type=int, default=2000, help="Lines every fake simulation prints.")
+    parser.add_argument("--error_rate", type=float, default=0.05, help="Share of failing fake simulations.")
+    parser.add_argument("--scenarios", type=str, default="st_cold,st_warm,single,single_so,regr",
+                        help="Comma separated scenarios to run.")
+    parser.add_argument("--work", type=str, default=None, help="Work directory, a temporary one by default.")
+    parser.add_argument("--json", type=str, default=None, help="Write the results to this JSON file.")
+    parser.add_argument("--compare", type=str, default=None, help="Baseline JSON to compare the overhead with.")
+    parser.add_argument("--tolerance", type=float, default=1.25,
+                        help="Allowed overhead ratio against the baseline.")
+    return parser.parse_args()
+
+
+def writeYaml(path, data):
+    with open(path, "w") as f:
+        yaml.safe_dump(data, f, sort_keys=False)
+
+
+def genConfig(args, workDir):
+    """
+    Generate a synthetic project: sources, nested test YAMLs and a regression list.
+
+    Args:
+        args : command line parser.
+        workDir : directory of the project.
+
+    Returns:
+        cfg : top config YAML.
+        regr : regression list YAML.
+        leaf : deepest test of the first extends chain.
+    """
+    srcDir = os.path.join(workDir, "src")
+    os.makedirs(os.path.join(srcDir, "inc"), exist_ok=True)
+    for name in ("bench_pkg.sv", "bench_tb.sv"):
+        with open(os.path.join(srcDir, name), "w") as f:
+            f.write("// %s\n" % name)
+    for i in range(50):
+        with open(os.path.join(srcDir, "inc", "seq_%d.svh" % i), "w") as f:
+            f.write("class seq_%d; endclass\n" % i)
+    with open(os.path.join(srcDir, "bench.f"), "w") as f:
+        f.write("+incdir+%s/inc\n%s/bench_pkg.sv\n" % (srcDir, srcDir))
+
+    tests = []
+    for i in range(args.tests):
+        test = {"test": "bench_test_%d" % i}
+        if i % args.depth != 0:
+            test["extends"] = "bench_test_%d" % (i - 1)
+        test["sim_opts"] = "+opt_%d=%d +bench_arg_%d" % (i % 50, i, i)
+        if i % args.depth == 0:
+            test["iterations"] = 1
+        tests.append(test)
+
+    files = [os.path.join(workDir, "tests_%d.yaml" % n) for n in range(args.files)]
+    for n, path in enumerate(files):
+        entries = []
+        # Chain the files in groups of args.nest imports deep
+        if (n + 1) % args.nest != 0 and n + 1 < len(files):
+            entries.append({"import": files[n + 1]})
+        entries.extend(tests[n::args.files])
+        writeYaml(path, entries)
+
+    cfg = os.path.join(workDir, "vcs.yaml")
+    top = [{"vcs": "vcs_command", "flist": "+incdir+%s %s/bench_tb.sv -f %s/bench.f" % (srcDir, srcDir, srcDir),
+            "top": "bench_top", "cmp_opts": "+define+BENCH", "elab_opts": "-debug_access"}]
+    for n in range(0, len(files), args.nest):
+        top.append({"import": files[n]})
+    # Imported twice on purpose, vrun must parse it only once
+    top.append({"import": files[0]})
+    writeYaml(cfg, top)
+
+    regr = os.path.join(workDir, "regr.yaml")
+    rand = random.Random(1)
+    writeYaml(regr, [{"test": "bench_test_%d" % rand.randrange(args.tests), "iterations": args.iterations}
+                     for i in range(args.regr_entries)])
+    return cfg, regr, "bench_test_%d" % (min(args.depth, args.tests) - 1)
+
+
+def runVrun(name, vrunArgs, workDir, env):
+    """
+    Run vrun once and measure it.
+
+    Args:
+        name : scenario name, also the name of its log file.
+        vrunArgs : vrun command line arguments.
+        workDir : directory vrun runs in.
+        env : environment of vrun.
+
+    Returns:
+        run : wall time, peak RSS in MB and return code.
+    """
+    logPath = os.path.join(workDir, name + ".log")
+    with open(logPath, "w") as log:
+        start = time.time()
+        ps = subprocess.Popen([sys.executable, vrunPath] + vrunArgs, cwd=workDir, env=env,
+                              stdout=log, stderr=subprocess.STDOUT)
+        status, usage = os.wait4(ps.pid, 0)[1:]
+        wall = time.time() - start
+    ps.returncode = os.waitstatus_to_exitcode(status)
+    if ps.returncode != 0:
+        print("%s: vrun exited with %d, see %s" % (name, ps.returncode, logPath))
+    return {"wall": wall, "peak_rss_mb": usage.ru_maxrss / 1024.0, "rc": ps.returncode}
+
+
+def main():
+    """
+    This is the main program.
+    """
+    args = parseArgs()
+    workDir = args.work or tempfile.mkdtemp(prefix="vrun_bench_")
+    os.makedirs(workDir, exist_ok=True)
+    cfg, regr, leaf = genConfig(args, workDir)
+    env = dict(os.environ)
+    env["PATH"] = os.path.join(benchDir, "bin") + os.pathsep + env.get("PATH", "")
+    env["XDG_CACHE_HOME"] = os.path.join(workDir, "cache")
+    env["VRUN_BENCH_PYTHON"] = sys.executable
+    env["VRUN_BENCH_SIM_TIME"] = str(args.sim_time)
+    env["VRUN_BENCH_COMPILE_TIME"] = str(args.compile_time)
+    env["VRUN_BENCH_LOG_LINES"] = str(args.log_lines)
+    env["VRUN_BENCH_ERROR_RATE"] = str(args.error_rate)
+    common = ["-cfg", cfg, "-o", os.path.join(workDir, "out")]
+    regrJobs = args.regr_entries * args.iterations
+    # name : (vrun arguments, wall time of the fake tools alone, number of simulations)
+    scenarios = {
+        "st_cold": (common + ["-st"], 0.0, 0),
+        "st_warm": (common + ["-st"], 0.0, 0),
+        "single": (common + ["-test", leaf, "-nocache"], 3 * args.compile_time + args.sim_time, 1),
+        "single_so": (common + ["-test", leaf, "-so"], args.sim_time, 1),
+        "regr": (common + ["-regr", regr, "-so", "-clean", "-j", str(args.jobs)],
+                 math.ceil(regrJobs / float(args.jobs)) * args.sim_time, regrJobs),
+    }
+    print("Work directory: %s" % workDir)
+    print("%d tests, extends depth %d, %d YAML files, %d regression jobs" %
+          (args.tests, args.depth, args.files, regrJobs))
+    results = {}
+    for name in args.scenarios.split(","):
+        if name not in scenarios:
+            raise ValueError("Unknown scenario: %s" % name)
+        if name == "st_cold":
+            shutil.rmtree(env["XDG_CACHE_HOME"], ignore_errors=True)
+        if name in ("single_so", "regr") and not os.path.isfile(os.path.join(workDir, "out", "compile", "vcs.simv")):
+            runVrun("compile", common + ["-co"], workDir, env)
+        vrunArgs, ideal, sims = scenarios[name]
+        run = runVrun(name, vrunArgs, workDir, env)
+        run["ideal"] = ideal
+        run["overhead"] = max(run["wall"] - ideal, 0.0)
+        run["overhead_per_sim_ms"] = run["overhead"] * 1000.0 / sims if sims else None
+        results[name] = run
+
+    print("%-10s %9s %9s %10s %14s %9s" % ("scenario", "wall(s)", "ideal(s)", "overhead", "per sim(ms)", "rss(MB)"))
+    for name, run in results.items():
+        perSim = "%.1f" % run["overhead_per_sim_ms"] if run["overhead_per_sim_ms"] is not None else "-"
+        print("%-10s %9.2f %9.2f %10.2f %14s %9.1f" % (name, run["wall"], run["ideal"], run["overhead"],
+                                                        perSim, run["peak_rss_mb"]))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+    failed = any(run["rc"] != 0 for run in results.values())
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)["results"]
+        for name, run in results.items():
+            if name not in baseline:
+                continue
+            # Half a second of slack keeps short scenarios from flapping
+            limit = baseline[name]["overhead"] * args.tolerance + 0.5
+            if run["overhead"] > limit:
+                print("REGRESSION %s: overhead %.2fs > %.2fs (baseline %.2fs)" %
+                      (name, run["overhead"], limit, baseline[name]["overhead"]))
+                failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+File: conftest.py
+Author: Ser_Lip
+Description: Shared fixtures of the vrun tests, a small project simulated by
+    the fake vlogan/vcs/simv of bench/bin.
+"""
+
+import os
+import sys
+import json
+import subprocess
+import pytest
+import yaml
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+repoDir = os.path.dirname(testDir)
+sys.path.insert(0, repoDir)
+
+
+class project(object):
+    """
+    Project directory with a config, run by vrun.py in a subprocess.
+    """
+    def __init__(self, root):
+        self.root = str(root)
+        self.cfg = os.path.join(self.root, "vcs.yaml")
+        os.makedirs(os.path.join(self.root, "src"))
+        with open(os.path.join(self.root, "src", "tb.sv"), "w") as f:
+            f.write("module tb; endmodule\n")
+        self.env = dict(os.environ)
+        self.env["PATH"] = os.path.join(repoDir, "bench", "bin") + os.pathsep + self.env.get("PATH", "")
+        self.env["XDG_CACHE_HOME"] = os.path.join(self.root, "cache")
+        self.env["VRUN_BENCH_PYTHON"] = sys.executable
+        self.env["VRUN_BENCH_LOG_LINES"] = "20"
+        self.env.pop("VRUN_SOCK", None)
+
+    def config(self, entries, vcs=None):
+        """
+        Write the config, one default vcs entry unless vcs is given.
+
+        Args:
+            entries : test entries.
+            vcs : vcs entries.
+
+        Returns:
+            Nothing
+        """
+        if vcs is None:
+            vcs = [{"vcs": "vcs_command", "flist": self.root + "/src/tb.sv", "top": "tb"}]
+        self.write("vcs.yaml", vcs + entries)
+
+    def write(self, name, data):
+        with open(os.path.join(self.root, name), "w") as f:
+            yaml.safe_dump(data, f, sort_keys=False)
+        return os.path.join(self.root, name)
+
+    def run(self, *args, out="out", check=True, env=None):
+        """
+        Run vrun.py in the project.
+
+        Args:
+            args : vrun arguments besides -cfg and -o.
+            out : output directory in the project.
+            check : fail the test when vrun exits with an error.
+            env : environment variables added for this run.
+
+        Returns:
+            ps : finished process, with its output in stdout.
+        """
+        runEnv = dict(self.env, **(env or {}))
+        ps = subprocess.run([sys.executable, os.path.join(repoDir, "vrun.py"), "-cfg", self.cfg,
+                             "-o", os.path.join(self.root, out)] + list(args),
+                            cwd=self.root, env=runEnv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            universal_newlines=True, timeout=120)
+        if check:
+            assert ps.returncode == 0, ps.stdout
+        return ps
+
+    def manifest(self, out="out"):
+        with open(os.path.join(self.root, out, "vrun_manifest.json"), "r") as f:
+            return json.load(f)
+
+
+@pytest.fixture
+def proj(tmp_path):
+    return project(tmp_path)
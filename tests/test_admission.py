@@ -0,0 +1,105 @@
+"""
+File: test_admission.py
+Author: Ser_Lip
+Description: Admission control of the simulations by licenses, memory and cpus.
+"""
+
+import time
+import threading
+import pytest
+import vrun
+
+
+@pytest.fixture(autouse=True)
+def stopEvent(monkeypatch):
+    event = threading.Event()
+    monkeypatch.setattr(vrun, "stopEvent", event)
+    return event
+
+
+def simJob(name, **need):
+    return dict({"test": name, "seed": 1}, **need)
+
+
+class waiter(object):
+    """
+    Acquire a job in a thread and record when it was admitted.
+    """
+    def __init__(self, ctrl, job):
+        self.job = job
+        self.waited = "running"
+        self.admitted = threading.Event()
+        queued = len(ctrl.waiting)
+        self.thread = threading.Thread(target=self.run, args=(ctrl,), daemon=True)
+        self.thread.start()
+        for i in range(200):
+            if self.admitted.is_set() or len(ctrl.waiting) > queued:
+                break
+            time.sleep(0.01)
+
+    def run(self, ctrl):
+        self.waited = ctrl.acquire(self.job)
+        self.admitted.set()
+
+
+def test_limits_hold_jobs_back():
+    ctrl = vrun.admissionCtrl({"licenses": 2, "mem": None, "cpus": None}, pollSecond=0.05)
+    first, second = simJob("a"), simJob("b")
+    assert ctrl.acquire(first) is not None and ctrl.acquire(second) is not None
+    third = waiter(ctrl, simJob("c"))
+    assert not third.admitted.wait(0.2)
+    ctrl.release(first)
+    assert third.admitted.wait(2)
+    assert ctrl.used["licenses"] == 2 and ctrl.running == 2
+
+
+def test_job_larger_than_the_limit_runs_alone():
+    ctrl = vrun.admissionCtrl({"licenses": None, "mem": 10, "cpus": None}, pollSecond=0.05)
+    assert ctrl.acquire(simJob("big", mem=30)) is not None
+    assert ctrl.running == 1
+
+
+def test_head_of_queue_is_not_starved():
+    ctrl = vrun.admissionCtrl({"licenses": None, "mem": 10, "cpus": None}, pollSecond=0.05)
+    smallA, smallB = simJob("a", mem=4), simJob("b", mem=4)
+    ctrl.acquire(smallA)
+    ctrl.acquire(smallB)
+    big = waiter(ctrl, simJob("big", mem=8))
+    smallC = waiter(ctrl, simJob("c", mem=4))
+    ctrl.release(smallA)
+    # 6 GB are free, enough for c but not for big, which came first
+    assert not smallC.admitted.wait(0.3)
+    assert not big.admitted.is_set()
+    ctrl.release(smallB)
+    assert big.admitted.wait(2)
+    assert not smallC.admitted.wait(0.3)
+    ctrl.release(big.job)
+    assert smallC.admitted.wait(2)
+    assert list(ctrl.waiting) == []
+
+
+def test_stop_leaves_the_queue(stopEvent):
+    ctrl = vrun.admissionCtrl({"licenses": 1, "mem": None, "cpus": None}, pollSecond=0.05)
+    ctrl.acquire(simJob("a"))
+    blocked = waiter(ctrl, simJob("b"))
+    stopEvent.set()
+    assert blocked.admitted.wait(2)
+    assert blocked.waited is None
+    assert ctrl.running == 1 and list(ctrl.waiting) == []
+
+
+def test_cancelled_job_frees_the_head():
+    ctrl = vrun.admissionCtrl({"licenses": 1, "mem": None, "cpus": None}, pollSecond=0.05)
+    first = simJob("a")
+    ctrl.acquire(first)
+    gone = threading.Event()
+    cancelled = threading.Thread(target=ctrl.acquire, args=(simJob("b"), gone.is_set), daemon=True)
+    cancelled.start()
+    time.sleep(0.1)
+    behind = waiter(ctrl, simJob("c"))
+    gone.set()
+    cancelled.join(2)
+    assert not cancelled.is_alive()
+    ctrl.release(first)
+    assert behind.admitted.wait(2)
+    assert ctrl.running == 1
@@ -0,0 +1,67 @@
+"""
+File: test_cov_merge.py
+Author: Ser_Lip
+Description: Background coverage merge with a stand-in merge command.
+"""
+
+import os
+import vrun
+
+# Concatenates the fake.cov of every input into the fake.cov of the output
+standInCmd = "mkdir -p {output} && for vdb in {inputs}; do cat $vdb/fake.cov; done > {output}/fake.cov"
+
+
+def simResult(root, name, status="PASS"):
+    simDir = os.path.join(str(root), name)
+    os.makedirs(simDir + "/cov.vdb")
+    with open(simDir + "/cov.vdb/fake.cov", "w") as f:
+        f.write(name + "\n")
+    return {"status": status, "dir": simDir}
+
+
+def covLines(vdb):
+    with open(vdb + "/fake.cov", "r") as f:
+        return sorted(f.read().split())
+
+
+def test_merge_tree_keeps_every_passing_input(tmp_path):
+    mergeDir = str(tmp_path / "cov_merge")
+    os.makedirs(mergeDir)
+    base = str(tmp_path / "cov.vdb")
+    os.makedirs(base)
+    with open(base + "/fake.cov", "w") as f:
+        f.write("compile\n")
+    merger = vrun.covMerger(standInCmd, mergeDir, str(tmp_path / "cov_merged.vdb"), 2, 3, [base], 60)
+    names = ["sim_%d" % i for i in range(10)]
+    for name in names:
+        merger.add(simResult(tmp_path, name))
+    merger.add(simResult(tmp_path, "failed_sim", "FAIL"))
+    output = merger.finish()
+    assert output == str(tmp_path / "cov_merged.vdb")
+    assert covLines(output) == sorted(names + ["compile"])
+    # Partial merges are removed once merged again
+    assert not [entry for entry in os.listdir(mergeDir) if entry.endswith(".vdb")]
+
+
+def test_merge_failure_gives_no_database(tmp_path):
+    mergeDir = str(tmp_path / "cov_merge")
+    os.makedirs(mergeDir)
+    merger = vrun.covMerger("exit 1", mergeDir, str(tmp_path / "cov_merged.vdb"), 1, 2, (), 60)
+    for i in range(3):
+        merger.add(simResult(tmp_path, "sim_%d" % i))
+    assert merger.finish() is None
+
+
+def test_merge_without_output_fails(tmp_path):
+    mergeDir = str(tmp_path / "cov_merge")
+    os.makedirs(mergeDir)
+    merger = vrun.covMerger("true {inputs} {output}", mergeDir, str(tmp_path / "cov_merged.vdb"), 1, 8, (), 60)
+    merger.add(simResult(tmp_path, "sim_0"))
+    assert merger.finish() is None
+
+
+def test_regression_merges_passing_tests(proj):
+    proj.config([{"test": "cov_test", "iterations": 4}])
+    proj.run("-test", "cov_test", "-cov", "-covmerge", "-covcmd", standInCmd, "-j", "2")
+    merged = os.path.join(proj.root, "out", "cov_merged.vdb")
+    assert len(covLines(merged)) == 8
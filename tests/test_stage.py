@@ -0,0 +1,87 @@
+"""
+File: test_stage.py
+Author: Ser_Lip
+Description: Host local staging of the compiled simv.
+"""
+
+import os
+import stat
+import pytest
+import vrun
+
+
+@pytest.fixture
+def cmpDir(tmp_path):
+    cmp = tmp_path / "compile"
+    (cmp / "vcs.simv.daidir" / "sub").mkdir(parents=True)
+    (cmp / "vcs.simv").write_text("#!/bin/bash\necho simv\n")
+    (cmp / "vcs.simv").chmod(0o755)
+    (cmp / "vcs.simv.daidir" / "sub" / "model.so").write_bytes(b"model" * 1000)
+    os.symlink("sub/model.so", str(cmp / "vcs.simv.daidir" / "link.so"))
+    vrun.saveCompileCache(str(cmp), {"file:x": "1"}, {})
+    return str(cmp)
+
+
+def test_stage_copies_and_reuses_the_image(cmpDir, tmp_path, monkeypatch):
+    stage = vrun.simvStage(str(tmp_path / "local"), cmpDir)
+    simv = stage.acquire()
+    image = os.path.dirname(simv)
+    with open(os.path.join(image, "vcs.simv.daidir", "sub", "model.so"), "rb") as f:
+        assert f.read() == b"model" * 1000
+    assert os.readlink(os.path.join(image, "vcs.simv.daidir", "link.so")) == "sub/model.so"
+    assert not os.stat(simv).st_mode & stat.S_IWUSR
+    # Reusing the image doesn't read its content again
+    monkeypatch.setattr(vrun, "hashFile", lambda path, statCache: pytest.fail("rehashed %s" % path))
+    other = vrun.simvStage(str(tmp_path / "local"), cmpDir)
+    assert other.acquire() == simv
+    other.release()
+    stage.release()
+
+
+def test_changed_image_is_staged_again(cmpDir, tmp_path):
+    stage = vrun.simvStage(str(tmp_path / "local"), cmpDir)
+    simv = stage.acquire()
+    stage.release()
+    model = os.path.join(os.path.dirname(simv), "vcs.simv.daidir", "sub", "model.so")
+    os.chmod(model, 0o644)
+    with open(model, "ab") as f:
+        f.write(b"broken")
+    again = vrun.simvStage(str(tmp_path / "local"), cmpDir)
+    assert again.acquire() == simv
+    with open(model, "rb") as f:
+        assert f.read() == b"model" * 1000
+    again.release()
+
+
+def test_failed_copy_leaves_nothing_behind(cmpDir, tmp_path, monkeypatch):
+    def fullDisk(src, dst):
+        raise OSError(28, "No space left on device")
+    monkeypatch.setattr(vrun.shutil, "copymode", fullDisk)
+    stage = vrun.simvStage(str(tmp_path / "local"), cmpDir)
+    with pytest.raises(OSError):
+        stage.acquire()
+    stage.release()
+    assert [name for name in os.listdir(stage.root) if not name.endswith(".lock")] == []
+
+
+def test_run_falls_back_when_staging_fails(proj):
+    proj.config([{"test": "stage_test"}])
+    blocker = os.path.join(proj.root, "not_a_dir")
+    with open(blocker, "w") as f:
+        f.write("")
+    ps = proj.run("-test", "stage_test", "-stage", blocker)
+    assert "Staging the simv of default failed" in ps.stdout
+    entry = proj.manifest()["jobs"][0]
+    assert entry["status"] == "PASS"
+    with open(entry["dir"] + "/sim.sh", "r") as f:
+        assert f.read().startswith(os.path.join(proj.root, "out", "compile", "vcs.simv"))
+
+
+def test_run_simulates_from_the_stage(proj):
+    proj.config([{"test": "stage_test", "iterations": 2}])
+    local = os.path.join(proj.root, "local")
+    proj.run("-test", "stage_test", "-stage", local, "-j", "2")
+    for entry in proj.manifest()["jobs"]:
+        assert entry["status"] == "PASS"
+        with open(entry["dir"] + "/sim.sh", "r") as f:
+            assert f.read().startswith(os.path.join(local, "vrun_stage_%d" % os.getuid()))
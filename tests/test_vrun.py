@@ -0,0 +1,686 @@
+"""
+File: test_vrun.py
+Author: Ser_Lip
+Description: Tests of the vrun helpers and of whole runs with the fake VCS.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import threading
+import argparse
+import subprocess
+import pytest
+import vrun
+from conftest import repoDir
+
+
+def job(index, test="t", seed=1, estimate=1.0, **extra):
+    return dict({"index": index, "test": test, "seed": seed, "sim_opts": "", "estimate": estimate}, **extra)
+
+
+def test_resolver_inherits_the_extends_chain():
+    resolver = vrun.testResolver([{"test": "base", "sim_opts": "+A=1 +B=1", "timeout": 50},
+                                  {"test": "mid", "extends": "base", "sim_opts": "+B=2"},
+                                  {"test": "leaf", "extends": "mid", "timeout": 10}])
+    leaf = resolver.resolve("leaf")
+    assert leaf["timeout"] == 10
+    assert leaf["sim_opts"].split() == ["+B=2", "+A=1"]
+    assert set(resolver.resolved) == {"base", "mid", "leaf"}
+    assert resolver.resolve("leaf") is leaf
+
+
+def test_resolver_reports_extends_loops():
+    resolver = vrun.testResolver([{"test": "a", "extends": "b"}, {"test": "b", "extends": "c"},
+                                  {"test": "c", "extends": "a"}, {"test": "d", "extends": "missing"}])
+    with pytest.raises(Exception, match="extends loop"):
+        resolver.resolve("a")
+    with pytest.raises(Exception, match="not found"):
+        resolver.resolve("d")
+
+
+def test_config_cache_follows_files_and_env(tmp_path, monkeypatch, caplog):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setenv("SUB_DIR", str(tmp_path / "a"))
+    monkeypatch.chdir(tmp_path)
+    for sub in ("a", "b"):
+        (tmp_path / sub).mkdir()
+        (tmp_path / sub / "sub.yaml").write_text("- test: %s_test\n" % sub)
+    cfg = tmp_path / "vcs.yaml"
+    cfg.write_text("- test: top_test\n- import: ${SUB_DIR}/sub.yaml\n")
+    caplog.set_level(logging.INFO)
+    names = lambda: [entry["test"] for entry in vrun.loadConfigEntries(str(cfg))]
+    assert names() == ["top_test", "a_test"]
+    caplog.clear()
+    assert names() == ["top_test", "a_test"]
+    assert "Loaded config from cache" in caplog.text
+    (tmp_path / "a" / "sub.yaml").write_text("- test: a_test\n- test: a2_test\n")
+    assert names() == ["top_test", "a_test", "a2_test"]
+    monkeypatch.setenv("SUB_DIR", str(tmp_path / "b"))
+    caplog.clear()
+    assert names() == ["top_test", "b_test"]
+    assert "Loaded config from cache" not in caplog.text
+    assert [entry["test"] for entry in vrun.loadConfigEntries(str(cfg), useCache=False)] == ["top_test", "b_test"]
+
+
+def test_expand_braces():
+    assert vrun.expandBraces("a/{b,c}/{d,e}.sv") == ["a/b/d.sv", "a/b/e.sv", "a/c/d.sv", "a/c/e.sv"]
+
+
+def test_run_test_and_reuse_compile(proj):
+    proj.config([{"test": "pass_test", "iterations": 3}])
+    ps = proj.run("-test", "pass_test", "-j", "2")
+    assert "TEST_PASS" in ps.stdout
+    assert proj.manifest()["info"]["run_id"]
+    assert sorted(entry["status"] for entry in proj.manifest()["jobs"]) == ["PASS"] * 3
+    ps = proj.run("-test", "pass_test")
+    assert "up to date" in ps.stdout
+    with open(os.path.join(proj.root, "src", "tb.sv"), "a") as f:
+        f.write("// changed\n")
+    ps = proj.run("-test", "pass_test")
+    assert "changed file:" in ps.stdout
+
+
+def test_killed_compile_isnt_cached(proj, tmp_path):
+    proj.config([{"test": "pass_test"}])
+    proj.run("-test", "pass_test")
+    with open(os.path.join(proj.root, "src", "tb.sv"), "a") as f:
+        f.write("// changed\n")
+    killBin = tmp_path / "kill_bin"
+    killBin.mkdir()
+    (killBin / "vcs").write_text("#!/bin/bash\nkill -9 $$\n")
+    (killBin / "vcs").chmod(0o755)
+    ps = proj.run("-test", "pass_test", check=False, env={"PATH": str(killBin) + os.pathsep + proj.env["PATH"]})
+    assert "TEST_PASS" not in ps.stdout
+    assert proj.manifest()["jobs"][0]["status"] == "CMP_FAIL"
+    cmpDir = os.path.join(proj.root, "out", "compile")
+    assert not os.path.exists(cmpDir + "/vcs.simv") and not os.path.exists(cmpDir + "/vrun_cache.json")
+    ps = proj.run("-test", "pass_test")
+    assert "up to date" not in ps.stdout
+    assert "Compile cache miss" in ps.stdout
+
+
+def dbRow(test, status, start, wall=10.0, seed=1):
+    return {"test": test, "status": status, "start": start, "end": start + wall, "wall": wall, "cpu": wall,
+            "seed": seed, "rc": 0, "sim_opts": "", "dir": "/out/%s_%d" % (test, seed),
+            "firstError": None if status == "PASS" else "UVM_ERROR x"}
+
+
+def test_results_db_queries(tmp_path):
+    db = vrun.resultsDB(str(tmp_path / "vrun.db"), "run1")
+    now = time.time()
+    db.record(dbRow("stable", "PASS", now - 300))
+    db.record(dbRow("flaky", "PASS", now - 200))
+    db.record(dbRow("flaky", "FAIL", now - 100, seed=2))
+    db.record(dbRow("old", "FAIL", now - 30 * 86400))
+    db.record(dict(dbRow("skipped", "SKIP", now), dir=None))
+    header, rows = db.query("failures", now - 86400)
+    assert header[1] == "test" and [row[1] for row in rows] == ["flaky"]
+    assert [row[0] for row in db.query("flaky", now - 86400)[1]] == ["flaky"]
+    assert {row[0] for row in db.query("trends", now - 86400)[1]} == {"stable", "flaky"}
+    assert db.query("failures", 0, "old")[1][0][1] == "old"
+    assert db.failingTests() == {"flaky", "old"}
+    db.close()
+
+
+def test_query_reads_the_run_history(proj):
+    proj.config([{"test": "q_test", "iterations": 2}])
+    proj.run("-test", "q_test", "-rseed", "1", check=False, env={"VRUN_BENCH_ERROR_RATE": "0.5"})
+    ps = proj.run("-query", "failures")
+    assert "start | test | seed | status | first_error | out_dir" in ps.stdout
+    fails = [entry for entry in proj.manifest()["jobs"] if entry["status"] != "PASS"]
+    assert "%d rows" % len(fails) in ps.stdout
+    ps = proj.run("-query", "trends", "-test", "q_test")
+    assert "1 rows" in ps.stdout
+
+
+def test_schedule_longest_first_from_history(tmp_path):
+    db = vrun.resultsDB(str(tmp_path / "vrun.db"), "run1")
+    now = time.time()
+    db.record(dbRow("short", "PASS", now - 50, wall=5.0))
+    db.record(dbRow("long", "PASS", now - 40, wall=100.0))
+    db.record(dbRow("mid", "FAIL", now - 30, wall=20.0))
+    jobList = [job(0, test="short"), job(1, test="new"), job(2, test="mid"), job(3, test="long")]
+    vrun.scheduleJobs(argparse.Namespace(ff=False), jobList, db)
+    assert [entry["test"] for entry in jobList] == ["long", "new", "mid", "short"]
+    assert jobList[1]["estimate"] == 20.0
+    vrun.scheduleJobs(argparse.Namespace(ff=True), jobList, db)
+    assert jobList[0]["test"] == "mid"
+    db.close()
+
+
+def test_plan_makespan():
+    jobList = [job(i, estimate=estimate) for i, estimate in enumerate([8.0, 5.0, 4.0, 3.0])]
+    assert vrun.planMakespan(jobList, 2) == 11.0
+    assert vrun.planMakespan(jobList, 4) == 8.0
+
+
+def test_plan_runs_nothing(proj):
+    proj.config([{"test": "p_test", "iterations": 3}])
+    ps = proj.run("-test", "p_test", "-j", "2", "-plan")
+    assert "3 jobs, 180.0s of simulation, predicted makespan with 2 jobs: 120.0s" in ps.stdout
+    assert not os.path.exists(os.path.join(proj.root, "out", "compile"))
+
+
+def test_failure_signature_ignores_seed_and_times():
+    first = {"status": "FAIL", "seed": 11, "dir": None,
+             "firstError": "UVM_ERROR /a/b/sb.sv(42) @ 1200ns: [CMP] seed 11 exp 0x12 act 32'h13"}
+    second = {"status": "FAIL", "seed": 99, "dir": None,
+              "firstError": "UVM_ERROR /c/sb.sv(42) @ 3400ns: [CMP] seed 99 exp 0x22 act 32'h23"}
+    assert vrun.failureSignature(first) == vrun.failureSignature(second)
+    assert vrun.failureSignature({"status": "HANG", "seed": 1, "dir": None}) == "<HANG>"
+
+
+def test_triage_groups_failures_by_signature():
+    results = [{"test": "a", "seed": 1, "status": "FAIL", "dir": "a_1", "wall": 30.0,
+                "firstError": "UVM_ERROR sb.sv(42) @ 100: [CMP] mismatch"},
+               {"test": "b", "seed": 2, "status": "FAIL", "dir": "b_2", "wall": 10.0,
+                "firstError": "UVM_ERROR sb.sv(42) @ 900: [CMP] mismatch"},
+               {"test": "a", "seed": 3, "status": "TIMEOUT", "dir": "a_3", "wall": 300.0},
+               {"test": "a", "seed": 4, "status": "PASS", "dir": "a_4", "wall": 5.0}]
+    buckets = {}
+    vrun.triageFailures(results, buckets)
+    assert sorted(bucket["count"] for bucket in buckets.values()) == [1, 2]
+    mismatch = buckets["UVM_ERROR sb.sv(42) @ <t>: [CMP] mismatch"]
+    assert dict(mismatch["tests"]) == {"a": 1, "b": 1}
+    assert mismatch["repro"]["dir"] == "b_2"
+
+
+def test_span_tracer_records_spans(tmp_path):
+    tracer = vrun.spanTracer()
+    with tracer.span("phase one", build="x") as spanArgs:
+        spanArgs["extra"] = 1
+    with tracer.span("sim one", "sim", False):
+        pass
+    path = str(tmp_path / "trace.json")
+    tracer.export(path)
+    with open(path, "r") as f:
+        events = json.load(f)["traceEvents"]
+    assert [(event["name"], event["cat"], event["ph"]) for event in events] == \
+        [("phase one", "phase", "X"), ("sim one", "sim", "X")]
+    assert events[0]["args"]["build"] == "x" and events[0]["args"]["extra"] == 1
+    assert "child_cpu" in events[0]["args"] and "child_cpu" not in events[1]["args"]
+
+
+def test_profile_writes_a_chrome_trace(proj):
+    proj.config([{"test": "prof_test", "iterations": 2}])
+    trace = os.path.join(proj.root, "trace.json")
+    ps = proj.run("-test", "prof_test", "-profile", trace)
+    assert "Slowest phases:" in ps.stdout
+    with open(trace, "r") as f:
+        events = json.load(f)["traceEvents"]
+    names = {event["name"] for event in events}
+    assert {"loadConfig", "extractTest", "vlogan UVM", "vlogan", "vcs", "simulations"} <= names
+    assert len([event for event in events if event["cat"] == "sim"]) == 2
+
+
+def test_manifest_resume_selects_unfinished_jobs(tmp_path):
+    path = str(tmp_path / "vrun_manifest.json")
+    manifest = vrun.runManifest(path, flushSecond=0)
+    manifest.plan([job(0), job(1), job(2)], {"run_id": "r"})
+    manifest.update({"index": 0, "status": "PASS", "dir": "d0", "wall": 1.0})
+    manifest.update({"index": 1, "status": "FAIL", "dir": "d1", "wall": 1.0})
+    loaded = vrun.runManifest(path)
+    loaded.load()
+    pending = []
+    loaded.select(("PENDING", "SKIP"), pending)
+    assert [job["index"] for job in pending] == [2]
+    failed = []
+    loaded.select(vrun.failStatuses, failed)
+    assert [job["index"] for job in failed] == [1]
+
+
+def test_failures_and_rerun(proj):
+    proj.config([{"test": "fail_test", "iterations": 2}])
+    ps = proj.run("-test", "fail_test", env={"VRUN_BENCH_ERROR_RATE": "1"})
+    assert "TEST_FAIL" in ps.stdout
+    assert [entry["status"] for entry in proj.manifest()["jobs"]] == ["FAIL", "FAIL"]
+    seeds = [entry["job"]["seed"] for entry in proj.manifest()["jobs"]]
+    ps = proj.run("-rerun")
+    assert "Rerun failed: 2 jobs" in ps.stdout
+    assert "up to date" in ps.stdout
+    assert [entry["status"] for entry in proj.manifest()["jobs"]] == ["PASS", "PASS"]
+    assert [entry["job"]["seed"] for entry in proj.manifest()["jobs"]] == seeds
+
+
+def test_seed_stream_is_deterministic():
+    first = vrun.seedGen(7)
+    second = vrun.seedGen(7)
+    seeds = [first.get("a") for i in range(5)]
+    assert seeds == [second.get("a") for i in range(5)]
+    assert len(set(seeds)) == 5
+    assert all(0 <= seed <= 0x7fffffff for seed in seeds)
+    assert vrun.seedGen(8).get("a") != seeds[0]
+
+
+def test_fail_budget_stops_a_test():
+    budget = vrun.failBudget(testFails=2)
+    for i in range(2):
+        budget.record({"test": "a", "status": "FAIL", "seed": i, "dir": None, "firstError": "UVM_ERROR x"})
+    assert budget.check(job(5, test="a")) is not None
+    assert budget.check(job(6, test="b")) is None
+
+
+def test_fail_budget_signature_and_regression_stops():
+    budget = vrun.failBudget(maxFails=4, signatureStop=2)
+    budget.record({"test": "a", "status": "FAIL", "seed": 1, "dir": None, "firstError": "UVM_ERROR @ 10: x"})
+    budget.record({"test": "a", "status": "FAIL", "seed": 2, "dir": None, "firstError": "UVM_ERROR @ 20: y"})
+    assert budget.check(job(1, test="a")) is None
+    budget.record({"test": "a", "status": "FAIL", "seed": 3, "dir": None, "firstError": "UVM_ERROR @ 30: x"})
+    assert "2 failures with" in budget.check(job(2, test="a"))
+    assert budget.check(job(3, test="b")) is None
+    budget.record({"test": "b", "status": "TIMEOUT", "seed": 4, "dir": None})
+    assert "regression stopped" in budget.check(job(4, test="b"))
+
+
+def test_regression_seed_draws_the_same_seeds(proj):
+    proj.config([{"test": "s_test", "iterations": 3}])
+    regr = proj.write("regr.yaml", [{"test": "s_test"}])
+    seeds = []
+    for out in ("run1", "run2"):
+        proj.run("-regr", regr, "-rseed", "42", out=out)
+        seeds.append([entry["job"]["seed"] for entry in proj.manifest(out)["jobs"]])
+    assert seeds[0] == seeds[1]
+    ps = proj.run("-regr", regr, "-testfails", "1", "-rseed", "42", check=False, env={"VRUN_BENCH_ERROR_RATE": "1"})
+    assert sorted(entry["status"] for entry in proj.manifest()["jobs"]) == ["FAIL", "SKIP", "SKIP"]
+
+
+def test_error_time_units():
+    assert vrun.errorTime("UVM_ERROR a.sv(3) @ 1200ns: [X] y") == 1200.0
+    assert vrun.errorTime("UVM_ERROR a.sv(3) @ 5 us: [X] y") == 5000.0
+    # UVM's default %t is in the 1ps precision of the compile
+    assert vrun.errorTime("UVM_ERROR a.sv(3) @ 2500000: [X] y") == 2500.0
+    assert vrun.errorTime("UVM_ERROR a.sv(3): [X] no time") is None
+
+
+def test_wave_rerun_starts_before_the_error(tmp_path):
+    args = argparse.Namespace(wof="fsdb", wpre=500.0, wscope=None)
+    jobList = [job(0), job(1)]
+    results = [{"index": 0, "status": "FAIL", "dir": str(tmp_path / "t_1"),
+                "firstError": "UVM_ERROR sb.sv(42) @ 2000000: uvm_test_top [CMP] mismatch"},
+               {"index": 1, "status": "PASS", "dir": str(tmp_path / "t_2"), "firstError": None}]
+    rerunList = []
+    vrun.waveJobs(args, jobList, results, rerunList)
+    assert len(rerunList) == 1 and rerunList[0]["dir"] == str(tmp_path / "t_1" / "waves")
+    assert rerunList[0]["waves"]["start"] == 1500.0
+    tcl = str(tmp_path / "sim.tcl")
+    vrun.writeSimTcl(tcl, rerunList[0]["waves"], "tb", False)
+    with open(tcl, "r") as f:
+        assert f.read().splitlines() == ["run 1500 ns", 'fsdbDumpfile "sim.fsdb"', "fsdbDumpvars 0 tb", "run"]
+
+
+def test_failed_jobs_rerun_with_waves(proj):
+    proj.config([{"test": "w_test", "iterations": 2}])
+    proj.run("-test", "w_test", "-wof", check=False, env={"VRUN_BENCH_ERROR_RATE": "1"})
+    for entry in proj.manifest()["jobs"]:
+        with open(entry["dir"] + "/waves/sim.sh", "r") as f:
+            assert "+fsdb+all" in f.read()
+
+
+def test_shard_split_covers_every_job_once():
+    jobList = [job(i, estimate=float(i % 7 + 1)) for i in range(50)]
+    plan, loads = vrun.shardJobs(jobList, 4)
+    assert set(job["shard"] for job in jobList) == {1, 2, 3, 4}
+    assert sum(loads) == sum(job["estimate"] for job in jobList)
+    assert max(loads) - min(loads) <= 7
+    again = [job(i, estimate=float(i % 7 + 1)) for i in range(50)]
+    assert vrun.shardJobs(again, 4)[0] == plan
+
+
+def test_shards_run_from_one_plan(proj):
+    proj.config([{"test": "a_test", "iterations": 5}, {"test": "b_test", "iterations": 4}])
+    regr = proj.write("regr.yaml", [{"test": "a_test"}, {"test": "b_test"}])
+    plan = os.path.join(proj.root, "plan.json")
+    assert proj.run("-regr", regr, "-shard", "1/2", check=False).returncode != 0
+    proj.run("-regr", regr, "-shard", "1/2", "-shardplan", plan, out="shard1")
+    # Another history mustn't change the split
+    proj.run("-regr", regr, "-shard", "2/2", "-shardplan", plan, "-rseed", str(json.load(open(plan))["rseed"]),
+             out="shard2")
+    jobs = [entry["job"]["index"] for out in ("shard1", "shard2") for entry in proj.manifest(out)["jobs"]]
+    assert sorted(jobs) == list(range(9))
+    assert proj.run("-regr", regr, "-shard", "2/3", "-shardplan", plan, check=False, out="shard3").returncode != 0
+    ps = proj.run("-merge", os.path.join(proj.root, "shard1", "vrun_manifest.json"),
+                  os.path.join(proj.root, "shard2", "vrun_manifest.json"))
+    assert "TEST_PASS" in ps.stdout
+    assert "Missing shards" not in ps.stdout
+
+
+def test_retain_log_truncate(tmp_path):
+    log = str(tmp_path / "sim.log")
+    with open(log, "w") as f:
+        f.writelines("line %d\n" % i for i in range(30))
+    vrun.retainLog(log, "truncate", keepLines=10)
+    with open(log, "r") as f:
+        lines = f.read().splitlines()
+    assert lines[0] == "... 20 lines truncated by vrun ..."
+    assert lines[1:] == ["line %d" % i for i in range(20, 30)]
+
+
+def test_job_directories_go_to_one_trash_batch(tmp_path, monkeypatch):
+    deletes = []
+    monkeypatch.setattr(vrun.subprocess, "Popen", lambda cmd, **kwargs: deletes.append(cmd))
+    trash = vrun.trashBatch()
+    for i in range(5):
+        (tmp_path / ("t_%d" % i)).mkdir()
+        (tmp_path / ("t_%d" % i) / "sim.log").write_text("old")
+        trash.add(str(tmp_path / ("t_%d" % i)))
+    batches = os.listdir(str(tmp_path / vrun.trashDir))
+    assert len(batches) == 1
+    assert len(os.listdir(str(tmp_path / vrun.trashDir / batches[0]))) == 5
+    assert not [name for name in os.listdir(str(tmp_path)) if name.startswith("t_")]
+    assert deletes == []
+    trash.flush()
+    assert deletes == [["rm", "-rf", str(tmp_path / vrun.trashDir / batches[0])]]
+
+
+def test_rerun_deletes_the_old_directories(proj):
+    proj.config([{"test": "r_test", "iterations": 3}])
+    proj.run("-test", "r_test", env={"VRUN_BENCH_ERROR_RATE": "1"}, check=False)
+    proj.run("-rerun")
+    trash = os.path.join(proj.root, "out", vrun.trashDir)
+    for i in range(100):
+        if not os.listdir(trash):
+            break
+        time.sleep(0.05)
+    assert os.listdir(trash) == []
+    assert [entry["status"] for entry in proj.manifest()["jobs"]] == ["PASS"] * 3
+
+
+def test_job_timeouts_from_yaml_history_and_build(tmp_path):
+    db = vrun.resultsDB(str(tmp_path / "vrun.db"), "run1")
+    now = time.time()
+    for i in range(5):
+        db.record(dbRow("long", "PASS", now - 100 + i, wall=100.0 * (i + 1), seed=i))
+        db.record(dbRow("short", "PASS", now - 100 + i, wall=1.0 + i, seed=i))
+    builds = {"default": {"sim_timeout": 900, "idle_timeout": 30}, "bare": {}}
+    jobList = [job(0, test="long", timeout=7), job(1, test="long"), job(2, test="short"), job(3, test="new"),
+               job(4, test="new", build="bare", idle_timeout=5)]
+    for entry in jobList:
+        entry.setdefault("build", "default")
+    vrun.jobTimeouts(argparse.Namespace(time=None, tfactor=2.0, idle=None), builds, jobList, db)
+    assert [entry["timeout"] for entry in jobList] == [7, 1000.0, vrun.minHistoryTimeout, 900, vrun.defaultTimeout]
+    assert [entry["idle_timeout"] for entry in jobList] == [30, 30, 30, 30, 5]
+    vrun.jobTimeouts(argparse.Namespace(time=20, tfactor=2.0, idle=3), builds, jobList, db)
+    assert {(entry["timeout"], entry["idle_timeout"]) for entry in jobList} == {(20, 3)}
+    db.close()
+
+
+def test_hang_is_killed(proj):
+    proj.config([{"test": "slow_test", "idle_timeout": 1}])
+    proj.run("-test", "slow_test", env={"VRUN_BENCH_SIM_TIME": "30", "VRUN_BENCH_LOG_LINES": "2"})
+    assert proj.manifest()["jobs"][0]["status"] == "HANG"
+
+
+def test_timeout_is_killed(proj):
+    proj.config([{"test": "slow_test", "timeout": 1}])
+    proj.run("-test", "slow_test", check=False, env={"VRUN_BENCH_SIM_TIME": "30"})
+    assert proj.manifest()["jobs"][0]["status"] == "TIMEOUT"
+
+
+def test_builds_compile_separately(proj):
+    vcs = [{"vcs": "vcs_command", "build": "rtl", "flist": proj.root + "/src/tb.sv", "top": "tb"},
+           {"vcs": "vcs_command", "build": "gate", "flist": proj.root + "/src/tb.sv", "top": "gate_tb",
+            "cmp_opts": "+define+GATE"}]
+    proj.config([{"test": "rtl_test", "iterations": 2}, {"test": "gate_test", "build": "gate"},
+                 {"test": "gate_sub", "extends": "gate_test"}], vcs)
+    regr = proj.write("regr.yaml", [{"test": "rtl_test"}, {"test": "gate_test"}, {"test": "gate_sub"}])
+    proj.run("-regr", regr, "-j", "3")
+    out = os.path.join(proj.root, "out")
+    assert os.path.isfile(out + "/compile_rtl/vcs.simv")
+    assert os.path.isfile(out + "/compile_gate/vcs.simv")
+    with open(out + "/compile_gate/vlogan.sh", "r") as f:
+        assert "+define+GATE" in f.read()
+    for entry in proj.manifest()["jobs"]:
+        with open(entry["dir"] + "/sim.sh", "r") as f:
+            simv = f.read().split()[0]
+        assert simv.endswith("/compile_%s/vcs.simv" % ("rtl" if entry["job"]["test"] == "rtl_test" else "gate"))
+
+
+def test_interrupt_between_compile_steps(tmp_path, monkeypatch):
+    monkeypatch.setattr(vrun, "stopEvent", threading.Event())
+    cmds = []
+
+    def fakeRun(cmd, tmoutSecond, stats=None, **kwargs):
+        cmds.append(cmd)
+        stats["rc"] = 0
+        # Ctrl-C once the step is done
+        vrun.stopEvent.set()
+    monkeypatch.setattr(vrun, "runCmd", fakeRun)
+    (tmp_path / "tb.sv").write_text("module tb; endmodule\n")
+    out = str(tmp_path / "out")
+    vcsOpts = {"flist": str(tmp_path / "tb.sv"), "top": "tb", "cmp_opts": "", "elab_opts": "", "cov": False,
+               "cmp_dir": out + "/compile", "cov_dir": out + "/cov.vdb"}
+    with pytest.raises(Exception, match="stopped after vlogan UVM"):
+        vrun.compileBuild(argparse.Namespace(time=None, nocache=False, clean=False), "default", vcsOpts, out)
+    assert len(cmds) == 1
+    assert not os.path.exists(out + "/compile/vrun_cache.json")
+
+
+def test_interrupt_does_not_wait_for_the_compiles(tmp_path, monkeypatch):
+    monkeypatch.setattr(vrun, "stopEvent", threading.Event())
+    compiling = threading.Event()
+
+    def slowCompile(args, name, vcsOpts, outputDir, usage=True):
+        compiling.set()
+        vrun.stopEvent.wait(5)
+        time.sleep(1)
+
+    def interrupt(*args):
+        compiling.wait(5)
+        raise KeyboardInterrupt
+    monkeypatch.setattr(vrun, "compileBuild", slowCompile)
+    monkeypatch.setattr(vrun, "simulate", interrupt)
+    args = argparse.Namespace(co=False, so=False, stage=None)
+    start = time.time()
+    with pytest.raises(KeyboardInterrupt):
+        vrun.processVCS(args, {"default": {}}, [job(0)], str(tmp_path))
+    assert time.time() - start < 0.5
+
+
+def test_daemon_lost_during_regression(proj, tmp_path):
+    sock = str(tmp_path / "vrun.sock")
+    daemon = subprocess.Popen([sys.executable, os.path.join(repoDir, "vrun.py"), "-daemon", "-sock", sock, "-lic", "1"],
+                              env=proj.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for i in range(100):
+            if os.path.exists(sock):
+                break
+            time.sleep(0.05)
+        proj.config([{"test": "lic_test", "iterations": 8}])
+        killer = threading.Timer(1.5, daemon.kill)
+        killer.start()
+        ps = proj.run("-test", "lic_test", "-j", "2", "-sock", sock, env={"VRUN_BENCH_SIM_TIME": "0.4"})
+        killer.join()
+    finally:
+        daemon.kill()
+        daemon.wait()
+    assert "Simulations are admitted by the vrun daemon" in ps.stdout
+    assert "lost, admitting simulations here" in ps.stdout
+    assert sorted(entry["status"] for entry in proj.manifest()["jobs"]) == ["PASS"] * 8
+
+
+def test_config_flattened_with_client_env_and_cwd(tmp_path, monkeypatch):
+    sub = tmp_path / "sub"
+    sub.mkdir()
+    (sub / "tests.yaml").write_text("- test: env_test\n- import: more.yaml\n")
+    (tmp_path / "more.yaml").write_text("- test: rel_test\n")
+    (tmp_path / "vcs.yaml").write_text("- import: ${TESTS_DIR}/tests.yaml\n")
+    monkeypatch.delenv("TESTS_DIR", raising=False)
+    monkeypatch.chdir(sub)
+    cache = vrun.buildConfigCache(str(tmp_path / "vcs.yaml"), {"TESTS_DIR": str(sub)}, str(tmp_path))
+    assert [entry["test"] for entry in cache["entries"]] == ["env_test", "rel_test"]
+    assert cache["env"] == {"TESTS_DIR": str(sub)}
+    assert cache["cwd"] == str(tmp_path)
+    assert "TESTS_DIR" not in os.environ and os.getcwd() == str(sub)
+
+
+def test_daemon_keeps_resolved_tests(tmp_path):
+    cfg = tmp_path / "vcs.yaml"
+    cfg.write_text("- vcs: vcs_command\n  flist: tb.sv\n  top: tb\n"
+                   "- test: base\n  sim_opts: +A=1\n  timeout: 50\n"
+                   "- test: child\n  extends: base\n  sim_opts: +B=1\n"
+                   "- test: other\n")
+    daemon = vrun.vrunDaemon(str(tmp_path / "vrun.sock"), {})
+    entries = daemon.config(str(cfg), str(tmp_path), {}, ["child"])
+    assert [entry.get("vcs") or entry["test"] for entry in entries] == ["vcs_command", "child"]
+    child = entries[1]
+    assert "extends" not in child and child["timeout"] == 50
+    assert "+A=1" in child["sim_opts"] and "+B=1" in child["sim_opts"]
+    resolver = daemon.configs[str(cfg)]["resolver"]
+    assert set(resolver.resolved) == {"base", "child"}
+    assert [entry["test"] for entry in daemon.config(str(cfg), str(tmp_path), {}, None)[1:]] == ["base", "child", "other"]
+
+
+def configArgs(sock):
+    return argparse.Namespace(sock=sock, nocache=False, st=False, test="env_test", regr=None,
+                              copt=None, eopt=None, cov=False)
+
+
+@pytest.fixture
+def daemonSock(tmp_path, monkeypatch):
+    sent = []
+    sendMsg = vrun.sendMsg
+    monkeypatch.setattr(vrun, "sendMsg", lambda conn, msg: (sent.append(msg), sendMsg(conn, msg)))
+    sock = str(tmp_path / "vrun.sock")
+    threading.Thread(target=vrun.vrunDaemon(sock, {}).serve, daemon=True).start()
+    for i in range(100):
+        if os.path.exists(sock):
+            break
+        time.sleep(0.05)
+    return sock, sent
+
+
+def test_daemon_gets_only_the_import_env_vars(tmp_path, monkeypatch, daemonSock):
+    sock, sent = daemonSock
+    (tmp_path / "tests.yaml").write_text("- test: env_test\n- import: ${MORE_DIR}/more.yaml\n")
+    (tmp_path / "more.yaml").write_text("- test: more_test\n")
+    (tmp_path / "vcs.yaml").write_text("- vcs: vcs_command\n  flist: tb.sv\n  top: tb\n"
+                                       "- import: $TESTS_DIR/tests.yaml\n")
+    monkeypatch.setenv("TESTS_DIR", str(tmp_path))
+    monkeypatch.setenv("MORE_DIR", str(tmp_path))
+    monkeypatch.setenv("VRUN_SECRET_TOKEN", "secret")
+    builds, testList = {}, []
+    vrun.loadConfig(configArgs(sock), str(tmp_path / "vcs.yaml"), builds, testList)
+    assert list(builds) == ["default"] and [test["test"] for test in testList] == ["env_test"]
+    requests = [msg for msg in sent if msg.get("op") == "config"]
+    assert requests[-1]["env"] == {"TESTS_DIR": str(tmp_path), "MORE_DIR": str(tmp_path)}
+    assert all("VRUN_SECRET_TOKEN" not in msg["env"] for msg in requests)
+    # The config is cached with the env vars it was asked for
+    sent.clear()
+    vrun.loadConfig(configArgs(sock), str(tmp_path / "vcs.yaml"), {}, [])
+    assert [msg for msg in sent if "needs" in msg] == [{"needs": ["TESTS_DIR", "MORE_DIR"]}]
+    assert "entries" in sent[-1]
+
+
+def test_config_not_sent_to_another_users_daemon(tmp_path, monkeypatch, caplog, daemonSock):
+    sock, sent = daemonSock
+    (tmp_path / "vcs.yaml").write_text("- vcs: vcs_command\n  flist: tb.sv\n  top: tb\n- test: env_test\n")
+    monkeypatch.setattr(vrun, "peerUid", lambda conn: os.getuid() + 1)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    testList = []
+    with caplog.at_level(logging.WARNING):
+        vrun.loadConfig(configArgs(sock), str(tmp_path / "vcs.yaml"), {}, testList)
+    assert "runs as uid %d, not as uid %d" % (os.getuid() + 1, os.getuid()) in caplog.text
+    assert [test["test"] for test in testList] == ["env_test"]
+    assert not [msg for msg in sent if msg.get("op") == "config"]
+
+
+def test_job_error_fails_only_that_job(monkeypatch):
+    def fakeSim(args, vcsOpts, job, outputDir, admission=None):
+        if job["index"] == 1:
+            raise OSError("No space left on device")
+        return {"index": job["index"], "test": job["test"], "seed": job["seed"], "dir": "d", "status": "PASS"}
+    monkeypatch.setattr(vrun, "runSim", fakeSim)
+    args = argparse.Namespace(jobs=2, dstep=False, vstep=False)
+    results = []
+    vrun.runJobs(args, {"default": {}}, [job(i, build="default") for i in range(4)], "out", results)
+    assert [result["status"] for result in results] == ["PASS", "FAIL", "PASS", "PASS"]
+    assert "No space left" in results[1]["firstError"]
+
+
+def test_run_error_stops_the_jobs(monkeypatch):
+    started = []
+    def fakeSim(args, vcsOpts, job, outputDir, admission=None):
+        started.append(job["index"])
+        return {"index": job["index"], "test": job["test"], "seed": job["seed"], "dir": "d", "status": "PASS"}
+    def brokenListener(result):
+        raise ValueError("listener bug")
+    monkeypatch.setattr(vrun, "runSim", fakeSim)
+    monkeypatch.setattr(vrun, "stopEvent", threading.Event())
+    args = argparse.Namespace(jobs=1, dstep=False, vstep=False)
+    with pytest.raises(ValueError):
+        vrun.runJobs(args, {"default": {}}, [job(i, build="default") for i in range(20)], "out", [], [brokenListener])
+    assert vrun.stopEvent.is_set()
+    assert len(started) < 20
+
+
+def test_same_test_and_seed_get_their_own_directories(proj):
+    proj.config([{"test": "t1"}])
+    regr = proj.write("regr.yaml", [{"test": "t1"}, {"test": "t1", "sim_opts": "+MODE=2"}])
+    proj.run("-regr", regr, "-seed", "5", "-j", "2")
+    entries = proj.manifest()["jobs"]
+    assert [entry["status"] for entry in entries] == ["PASS", "PASS"]
+    assert [os.path.basename(entry["dir"]) for entry in entries] == ["t1_5", "t1_5_1"]
+    for entry in entries:
+        with open(entry["dir"] + "/sim.sh", "r") as f:
+            assert ("+MODE=2" in f.read()) == (entry["job"]["index"] == 1)
+
+
+def test_crashed_simulation_fails(proj):
+    proj.config([{"test": "crash_test"}])
+    ps = proj.run("-test", "crash_test", check=False, env={"VRUN_BENCH_SIGNAL": str(int(signal.SIGSEGV))})
+    assert "TEST_PASS" not in ps.stdout
+    entry = proj.manifest()["jobs"][0]
+    assert entry["status"] == "SIGNAL"
+    assert entry["rc"] == -signal.SIGSEGV and entry["firstError"] == "Killed by SIGSEGV"
+    assert os.path.isfile(entry["dir"] + "/SIGNAL") and not os.path.exists(entry["dir"] + "/PASS")
+
+
+def test_rerun_keeps_compile_options(proj):
+    proj.config([{"test": "cov_test", "iterations": 2}])
+    proj.run("-test", "cov_test", "-cov", "-copt", "+define+X", env={"VRUN_BENCH_ERROR_RATE": "1"})
+    ps = proj.run("-rerun", "-fsdb")
+    assert "up to date" in ps.stdout
+    assert "Compile cache miss" not in ps.stdout
+    assert [entry["status"] for entry in proj.manifest()["jobs"]] == ["PASS", "PASS"]
+    ps = proj.run("-resume", "-copt", "+define+Y", check=False)
+    assert "keep the compile options" in ps.stdout
+
+
+def test_compile_output_is_logged(proj):
+    proj.config([{"test": "pass_test"}])
+    proj.run("-test", "pass_test", "-co")
+    cmpDir = os.path.join(proj.root, "out", "compile")
+    with open(cmpDir + "/vlogan.out", "r") as f:
+        assert "tb.sv" in f.read()
+    with open(cmpDir + "/vcs.out", "r") as f:
+        assert "vcs elaborating" in f.read()
+
+
+def test_log_analyzer_counts_and_aborts():
+    errors, warnings = io.StringIO(), io.StringIO()
+    analyzer = vrun.logAnalyzer(errors, warnings, maxErrors=2)
+    assert not analyzer.feed("UVM_INFO a.sv(1) @ 0: hello\n")
+    assert not analyzer.feed("UVM_WARNING a.sv(2) @ 5: careful\n")
+    assert not analyzer.feed("UVM_ERROR a.sv(3) @ 10: first\n")
+    assert not analyzer.feed("UVM_ERROR :    0\n")
+    assert analyzer.feed("UVM_ERROR a.sv(4) @ 20: second\n")
+    assert analyzer.errorCnt == 2 and analyzer.warningCnt == 1
+    assert analyzer.firstError == "UVM_ERROR a.sv(3) @ 10: first"
+    assert errors.getvalue().count("UVM_ERROR") == 2
+    fatal = vrun.logAnalyzer(io.StringIO(), io.StringIO(), maxErrors=10)
+    assert fatal.feed("UVM_FATAL a.sv(5) @ 30: stop\n")
+
+
+def test_max_errors_kills_the_simulation(proj):
+    proj.config([{"test": "err_test"}])
+    start = time.time()
+    ps = proj.run("-test", "err_test", "-maxerr", "1", check=False,
+                  env={"VRUN_BENCH_ERROR_RATE": "1", "VRUN_BENCH_SIM_TIME": "30"})
+    assert time.time() - start < 20
+    assert "killed after 1 errors" in ps.stdout
+    assert proj.manifest()["jobs"][0]["status"] == "FAIL"
@@ -4,7 +4,6 @@ Author: Ser_Lip
 Description: Ser_Lip's vcs command script
 TODO: >
     yaml optimize
-    regr parallel logic
     other optimize
 """
 
@@ -15,22 +14,1399 @@ import subprocess
 import logging
 import yaml
 import random
+import heapq
+import math
+import statistics
+import json
+import pickle
+import shlex
+import hashlib
+import shutil
+import fnmatch
+import tempfile
 import datetime
+import time
+import sqlite3
+import signal
+import threading
+import contextlib
+import resource
+import fcntl
+import socket
+import struct
+import atexit
+import types
+import collections
+import concurrent.futures
 
 class seedGen(object):
     """
-    An object that will generate a pseudo-random seed for test iterations.
+    A deterministic stream of seeds for test iterations.
 
-    Not used now!
+    The n-th seed drawn for a test only depends on the regression seed,
+    the test name and n, so a regression run again with the same
+    regression seed gets the same seeds.
     """
     def __init__(self, startSeed):
         self.startSeed = startSeed
+        self.drawn = collections.Counter()
 
-    def get(self, testIter=0):
-        return self.startSeed + testIter
+    def get(self, name):
+        """
+        Draw the next seed of a test.
 
-    def getRand(self):
-        return random.getrandbits(31)
+        Args:
+            name : test name.
+
+        Returns:
+            seed : non-negative 31-bit seed.
+        """
+        digest = hashlib.sha1(("%d/%s/%d" % (self.startSeed, name, self.drawn[name])).encode()).digest()
+        self.drawn[name] += 1
+        return int.from_bytes(digest[:4], "big") & 0x7fffffff
+
+
+class testResolver(object):
+    """
+    Resolve tests with their extends chain from an index of the test list.
+
+    Every test is resolved once, the resolved tests are read-only views that
+    callers have to copy before changing them. The test list is not modified.
+    """
+    def __init__(self, testList):
+        self.index = {}
+        self.resolved = {}
+        for entry in testList:
+            if entry["test"] in self.index:
+                logging.warning("Test %s is defined more than once, using the last one." % entry["test"])
+            self.index[entry["test"]] = entry
+
+    def resolve(self, testname):
+        """
+        Get a test with the options inherited from its extends chain.
+
+        Args:
+            testname : name of the test.
+
+        Returns:
+            test : read-only resolved test.
+        """
+        chain = []
+        chainSet = set()
+        name = testname
+        while name not in self.resolved:
+            if name not in self.index:
+                logging.error("No testname: %s found in test list!" % name)
+                raise Exception("Test not found.")
+            if name in chainSet:
+                logging.error("Test extends loop: %s" % " -> ".join(chain + [name]))
+                raise Exception("<YAML Error> Test extends loop.")
+            chain.append(name)
+            chainSet.add(name)
+            if "extends" not in self.index[name]:
+                break
+            name = self.index[name]["extends"]
+        for name in reversed(chain):
+            self.resolved[name] = types.MappingProxyType(self.inherit(self.index[name]))
+        return self.resolved[testname]
+
+    def inherit(self, entry):
+        """
+        Merge a test entry with its resolved father.
+
+        Args:
+            entry : test entry from the test list.
+
+        Returns:
+            test : test with the father's parameters it doesn't set itself.
+        """
+        test = dict(entry)
+        test["sim_opts"] = str(entry.get("sim_opts") or "")
+        if "extends" not in entry:
+            return test
+        father = self.resolved[entry["extends"]]
+        for param in father:
+            if param == "test" or param == "extends":
+                continue
+            elif param == "sim_opts":
+                test["sim_opts"] = mergeSimOpts(father["sim_opts"], test["sim_opts"])
+            elif param not in test:
+                test[param] = father[param]
+        return test
+
+
+class logAnalyzer(object):
+    """
+    Classify simulator output line by line while the simulation runs.
+
+    Error and warning lines go straight to error_message.log and
+    warning_message.log, nothing else of the log is kept in memory.
+    """
+    errorRe = re.compile(r"^UVM_(?:ERROR|FATAL)|Error")
+    warningRe = re.compile(r"^UVM_WARNING")
+    fatalRe = re.compile(r"^UVM_FATAL")
+    summaryRe = re.compile(r"^UVM_(?:ERROR|FATAL|WARNING)\s*:\s*(\d+)\s*$")
+
+    def __init__(self, errorLog, warningLog, maxErrors=None):
+        self.errorLog = errorLog
+        self.warningLog = warningLog
+        self.maxErrors = maxErrors
+        self.errorCnt = 0
+        self.warningCnt = 0
+        self.fatal = False
+        self.aborted = False
+        self.hasError = False
+        self.firstError = None
+
+    def feed(self, line):
+        """
+        Classify one output line.
+
+        Args:
+            line : output line of the simulator.
+
+        Returns:
+            True if the simulation should be aborted.
+        """
+        if "UVM_" not in line and "Error" not in line:
+            return False
+        summary = self.summaryRe.match(line)
+        if summary is not None and summary.group(1) == "0":
+            return False
+        if self.errorRe.search(line):
+            self.errorLog.write(line)
+            self.hasError = True
+            if summary is None:
+                self.errorCnt += 1
+                if self.firstError is None:
+                    self.firstError = line.strip()
+                if self.fatalRe.match(line):
+                    self.fatal = True
+        elif self.warningRe.match(line):
+            self.warningLog.write(line)
+            if summary is None:
+                self.warningCnt += 1
+        if self.maxErrors is not None and not self.aborted:
+            if self.fatal or self.errorCnt >= self.maxErrors:
+                self.aborted = True
+        return self.aborted
+
+
+class resultsDB(object):
+    """
+    SQLite database of every simulation run, for history queries.
+    """
+    columns = [("run_id", "TEXT"), ("test", "TEXT"), ("uvm_test", "TEXT"), ("sim_opts", "TEXT"),
+               ("seed", "INTEGER"), ("start", "REAL"), ("end", "REAL"), ("wall", "REAL"),
+               ("cpu", "REAL"), ("rc", "INTEGER"), ("status", "TEXT"), ("first_error", "TEXT"),
+               ("out_dir", "TEXT"), ("queue_wait", "REAL")]
+
+    def __init__(self, path, runId=None):
+        self.path = path
+        self.runId = runId
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY)")
+        known = [row[1] for row in self.conn.execute("PRAGMA table_info(runs)")]
+        for name, sqlType in self.columns:
+            if name not in known:
+                self.conn.execute("ALTER TABLE runs ADD COLUMN %s %s" % (name, sqlType))
+        self.conn.execute("CREATE INDEX IF NOT EXISTS runs_start ON runs (start)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS runs_test_start ON runs (test, start)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS runs_status_start ON runs (status, start)")
+        self.conn.commit()
+
+    def record(self, result):
+        """
+        Insert the result of a simulation.
+
+        Args:
+            result : result returned by runSim.
+
+        Returns:
+            Nothing
+        """
+        if result["status"] in ("SKIP", "CMP_FAIL"):
+            # Skipped jobs and jobs without a build never ran
+            return
+        row = dict(result, run_id=self.runId, first_error=result.get("firstError"),
+                   out_dir=result.get("dir"))
+        names = [name for name, sqlType in self.columns]
+        self.conn.execute("INSERT INTO runs (%s) VALUES (%s)" % (", ".join(names), ", ".join("?" * len(names))),
+                          [row.get(name) for name in names])
+        self.conn.commit()
+
+    def query(self, kind, since, test=None):
+        """
+        Query the run history.
+
+        Args:
+            kind : failures, flaky or trends.
+            since : only runs started after this time.
+            test : only runs of this test if set.
+
+        Returns:
+            header : column names.
+            rows : query result.
+        """
+        where = "start >= ?"
+        params = [since]
+        if test is not None:
+            where += " AND test = ?"
+            params.append(test)
+        if kind == "failures":
+            header = ["start", "test", "seed", "status", "first_error", "out_dir"]
+            sql = ("SELECT datetime(start, 'unixepoch', 'localtime'), test, seed, status, first_error, out_dir "
+                   "FROM runs WHERE %s AND status != 'PASS' ORDER BY start DESC" % where)
+        elif kind == "flaky":
+            header = ["test", "runs", "pass", "fail", "fail_rate"]
+            sql = ("SELECT test, COUNT(*), SUM(status = 'PASS'), SUM(status != 'PASS'), "
+                   "ROUND(AVG(status != 'PASS'), 3) AS rate FROM runs WHERE %s GROUP BY test "
+                   "HAVING SUM(status = 'PASS') > 0 AND SUM(status != 'PASS') > 0 "
+                   "ORDER BY rate DESC, test" % where)
+        elif kind == "trends":
+            header = ["test", "day", "runs", "avg_wall", "max_wall", "avg_cpu"]
+            sql = ("SELECT test, date(start, 'unixepoch', 'localtime') AS day, COUNT(*), "
+                   "ROUND(AVG(wall), 1), ROUND(MAX(wall), 1), ROUND(AVG(cpu), 1) "
+                   "FROM runs WHERE %s GROUP BY test, day ORDER BY test, day" % where)
+        else:
+            raise ValueError("<Config Error> Unknown query: %s." % kind)
+        return header, self.conn.execute(sql, params).fetchall()
+
+    def durations(self, lastRuns=10, excludeRuns=None):
+        """
+        Get the typical simulation time of every test from its last runs.
+
+        Args:
+            lastRuns : number of latest runs of a test used.
+            excludeRuns : SQL LIKE pattern of run ids not used, None to use all.
+
+        Returns:
+            durations : test name to median wall time of its last runs.
+        """
+        walls = {}
+        rows = self.conn.execute(
+            "SELECT test, wall FROM (SELECT test, wall, ROW_NUMBER() OVER "
+            "(PARTITION BY test ORDER BY start DESC) AS rn FROM runs WHERE wall IS NOT NULL "
+            "AND run_id NOT LIKE ?) WHERE rn <= ?", [excludeRuns or "", lastRuns])
+        for test, wall in rows:
+            walls.setdefault(test, []).append(wall)
+        return {test: statistics.median(walls[test]) for test in walls}
+
+    def percentiles(self, quantile=0.95, lastRuns=20, minRuns=5):
+        """
+        Get a percentile of the simulation time of every test from its last passing runs.
+
+        Args:
+            quantile : percentile wanted, from 0 to 1.
+            lastRuns : number of latest passing runs of a test used.
+            minRuns : tests with fewer passing runs are left out.
+
+        Returns:
+            percentiles : test name to wall time percentile.
+        """
+        walls = {}
+        rows = self.conn.execute(
+            "SELECT test, wall FROM (SELECT test, wall, ROW_NUMBER() OVER "
+            "(PARTITION BY test ORDER BY start DESC) AS rn FROM runs WHERE wall IS NOT NULL "
+            "AND status = 'PASS') WHERE rn <= ?", [lastRuns])
+        for test, wall in rows:
+            walls.setdefault(test, []).append(wall)
+        return {test: sorted(walls[test])[math.ceil(quantile * len(walls[test])) - 1]
+                for test in walls if len(walls[test]) >= minRuns}
+
+    def failingTests(self):
+        """
+        Get the tests whose latest run didn't pass.
+
+        Returns:
+            tests : set of test names.
+        """
+        rows = self.conn.execute(
+            "SELECT test FROM (SELECT test, status, ROW_NUMBER() OVER "
+            "(PARTITION BY test ORDER BY start DESC) AS rn FROM runs) WHERE rn = 1 AND status != 'PASS'")
+        return {row[0] for row in rows}
+
+    def close(self):
+        self.conn.close()
+
+
+class runManifest(object):
+    """
+    Durable list of every planned job of a run and its status.
+
+    The manifest is rewritten atomically, at most every flushSecond while
+    jobs finish, so a run killed at any time can be resumed with the
+    same seeds.
+    """
+    def __init__(self, path, flushSecond=1.0):
+        self.path = path
+        self.flushSecond = flushSecond
+        self.info = {}
+        self.entries = {}
+        self.lastFlush = 0.0
+
+    def load(self):
+        """
+        Load the manifest of a previous run.
+
+        Returns:
+            Nothing
+        """
+        if not os.path.isfile(self.path):
+            logging.error("Didn't find run manifest %s." % self.path)
+            raise Exception("<Config Error> No run to resume in the output directory.")
+        with open(self.path, "r") as f:
+            data = json.load(f)
+        self.info = data["info"]
+        self.entries = {entry["job"]["index"]: entry for entry in data["jobs"]}
+
+    def plan(self, jobList, info):
+        """
+        Start a new manifest with every job pending.
+
+        Args:
+            jobList : jobs of the run.
+            info : run information kept with the jobs.
+
+        Returns:
+            Nothing
+        """
+        self.info = info
+        self.entries = {job["index"]: {"job": dict(job), "status": "PENDING", "dir": None, "wall": None}
+                        for job in jobList}
+        self.flush()
+
+    def select(self, statuses, jobList):
+        """
+        Get the jobs with one of the statuses back to pending.
+
+        Args:
+            statuses : statuses of the jobs to run again.
+            jobList : selected jobs.
+
+        Returns:
+            Nothing
+        """
+        for index in sorted(self.entries):
+            entry = self.entries[index]
+            if entry["status"] in statuses:
+                entry["status"] = "PENDING"
+                jobList.append(dict(entry["job"]))
+        self.flush()
+
+    def update(self, result):
+        """
+        Record the result of a finished job.
+
+        Args:
+            result : result returned by runSim.
+
+        Returns:
+            Nothing
+        """
+        entry = self.entries.get(result["index"])
+        if entry is None:
+            return
+        entry.update(status=result["status"], dir=result["dir"], wall=result.get("wall"), rc=result.get("rc"),
+                     firstError=result.get("firstError"))
+        if time.time() - self.lastFlush >= self.flushSecond:
+            self.flush()
+
+    def counts(self):
+        return collections.Counter(entry["status"] for entry in self.entries.values())
+
+    def results(self, results):
+        """
+        Get the latest result of every job.
+
+        Args:
+            results : job results, like the ones of runSim.
+
+        Returns:
+            Nothing
+        """
+        for index in sorted(self.entries):
+            entry = self.entries[index]
+            job = entry["job"]
+            results.append({"index": index, "test": job["test"], "uvm_test": job.get("uvm_test"),
+                            "seed": job["seed"], "sim_opts": job["sim_opts"].strip(), "dir": entry["dir"],
+                            "status": entry["status"], "wall": entry["wall"], "rc": entry.get("rc"),
+                            "firstError": entry.get("firstError")})
+
+    def flush(self):
+        """
+        Write the manifest to a temporary file and rename it over the old one.
+
+        Returns:
+            Nothing
+        """
+        tmpPath = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmpPath, "w") as f:
+            json.dump({"info": self.info, "jobs": [self.entries[index] for index in sorted(self.entries)]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath, self.path)
+        self.lastFlush = time.time()
+
+
+class covMerger(object):
+    """
+    Merge coverage databases in the background while the regression runs.
+
+    Passing simulations are merged in groups of fanIn into partial merges,
+    and partial merges are merged again, at most maxJobs at a time. finish()
+    merges what is left into the final database.
+    """
+    def __init__(self, cmd, mergeDir, output, maxJobs, fanIn, baseInputs=(), tmoutSecond=3600):
+        self.cmd = cmd
+        self.mergeDir = mergeDir
+        self.output = output
+        self.fanIn = fanIn
+        self.baseInputs = list(baseInputs)
+        self.tmoutSecond = tmoutSecond
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=maxJobs)
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.pending = []
+        self.running = 0
+        self.partNum = 0
+        self.broken = False
+
+    def add(self, result):
+        """
+        Queue the coverage database of a finished simulation, listener of runJobs.
+
+        Args:
+            result : result returned by runSim.
+
+        Returns:
+            Nothing
+        """
+        if result["status"] == "PASS" and os.path.isdir(result["dir"] + "/cov.vdb"):
+            with self.lock:
+                self.pending.append(result["dir"] + "/cov.vdb")
+                self.launch()
+
+    def launch(self):
+        """
+        Start a partial merge for every full group of pending databases, lock held.
+
+        Returns:
+            Nothing
+        """
+        while not self.broken and len(self.pending) >= self.fanIn:
+            inputs = self.pending[:self.fanIn]
+            del self.pending[:self.fanIn]
+            self.partNum += 1
+            self.running += 1
+            self.executor.submit(self.mergePart, inputs, "%s/part_%d.vdb" % (self.mergeDir, self.partNum))
+
+    def merge(self, inputs, output):
+        """
+        Run the merge command.
+
+        Args:
+            inputs : databases to merge.
+            output : merged database.
+
+        Returns:
+            True if the merge succeeded.
+        """
+        cmd = self.cmd.format(inputs=" ".join(inputs), output=output)
+        try:
+            # Through bash -c, the template can be a whole shell command line
+            runCmd("bash -c %s" % shlex.quote(cmd), self.tmoutSecond, cwd=self.mergeDir, stream=True)
+        except Exception as exc:
+            logging.error("Coverage merge failed: %s" % exc)
+            return False
+        if not os.path.isdir(output):
+            logging.error("Coverage merge didn't write %s: %s" % (output, cmd))
+            return False
+        for vdb in inputs:
+            if os.path.dirname(vdb) == self.mergeDir:
+                shutil.rmtree(vdb, ignore_errors=True)
+        return True
+
+    def mergePart(self, inputs, output):
+        merged = self.merge(inputs, output)
+        with self.lock:
+            self.running -= 1
+            if merged:
+                self.pending.append(output)
+            else:
+                self.broken = True
+                self.pending.extend(inputs)
+            self.launch()
+            self.idle.notify_all()
+
+    def finish(self):
+        """
+        Wait for the partial merges and merge the rest into the final database.
+
+        Returns:
+            output : final database, None if the merge failed.
+        """
+        with self.lock:
+            while self.running:
+                self.idle.wait()
+            inputs = self.baseInputs + self.pending
+            self.pending = []
+        self.executor.shutdown()
+        if len(inputs) == len(self.baseInputs):
+            logging.warning("No coverage database to merge.")
+            return None
+        logging.info("------ Starting final coverage merge of %d databases ------" % len(inputs))
+        if os.path.isdir(self.output):
+            shutil.rmtree(self.output)
+        if not self.merge(inputs, self.output):
+            return None
+        logging.info("Merged coverage: %s" % self.output)
+        return self.output
+
+    def cancel(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class simvStage(object):
+    """
+    Host local read-only copy of the compiled simv, shared by all the
+    simulations of the host.
+
+    Every image lives in <root>/vrun_stage_<uid>/<key> next to a <key>.lock
+    file. Users of an image hold a shared flock on its lock while they
+    simulate, staging and cleanup take the exclusive flock, so an image is
+    never changed or removed under a running simulation. The content of
+    an image is checked once, when it is copied, runs reusing it only check
+    the size and mtime of its files.
+    """
+    def __init__(self, root, cmpDir, simv="vcs.simv"):
+        self.root = os.path.join(root, "vrun_stage_%d" % os.getuid())
+        self.cmpDir = cmpDir
+        self.simv = simv
+        self.lock = None
+
+    def key(self):
+        """
+        Key of the compiled image, changed by every compile.
+
+        Returns:
+            key : compile cache key and simv mtime digest.
+        """
+        st = os.stat(os.path.join(self.cmpDir, self.simv))
+        text = "%s/%d/%d" % (loadCompileCache(self.cmpDir).get("key"), st.st_mtime_ns, st.st_size)
+        return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+    def acquire(self):
+        """
+        Stage the image if this host doesn't have a verified copy yet and
+        hold it for the simulations.
+
+        Returns:
+            simv : path of the staged simv.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        key = self.key()
+        image = os.path.join(self.root, key)
+        self.lock = open(image + ".lock", "a")
+        while True:
+            # Runs reusing the image check it at the same time
+            fcntl.flock(self.lock, fcntl.LOCK_SH)
+            if self.verify(image):
+                logging.info("Reusing staged simv %s" % image)
+                break
+            # Converting the lock isn't atomic, another run may stage it in between
+            fcntl.flock(self.lock, fcntl.LOCK_EX)
+            if not self.verify(image):
+                for name in os.listdir(self.root):
+                    if name.startswith(key + ".tmp"):
+                        self.remove(os.path.join(self.root, name))
+                self.remove(image)
+                with tracer.span("stage simv"):
+                    self.copy(image)
+            # A cleanup may slip in between too
+            fcntl.flock(self.lock, fcntl.LOCK_SH)
+            if self.verify(image):
+                break
+        self.cleanup(key)
+        return os.path.join(image, self.simv)
+
+    def release(self):
+        if self.lock is not None:
+            self.lock.close()
+            self.lock = None
+
+    def sources(self):
+        """
+        List the files of the compiled image.
+
+        Returns:
+            files : path relative to the compile directory of the simv and
+                    of every file of its daidir.
+        """
+        files = [self.simv]
+        for dirPath, dirNames, fileNames in os.walk(os.path.join(self.cmpDir, self.simv + ".daidir")):
+            relDir = os.path.relpath(dirPath, self.cmpDir)
+            files.extend(os.path.join(relDir, name) for name in fileNames)
+            files.extend(os.path.join(relDir, name) for name in dirNames
+                         if os.path.islink(os.path.join(dirPath, name)))
+        return sorted(files)
+
+    def copy(self, image):
+        """
+        Copy the image to a temporary directory, check every copied file
+        against the digest of its source and rename it to image.
+
+        Args:
+            image : directory of the staged image.
+
+        Returns:
+            Nothing
+        """
+        tmpDir = "%s.tmp%d" % (image, os.getpid())
+        logging.info("Staging %s/%s to %s" % (self.cmpDir, self.simv, image))
+        checksums = {}
+        try:
+            for rel in self.sources():
+                src = os.path.join(self.cmpDir, rel)
+                dst = os.path.join(tmpDir, rel)
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                if os.path.islink(src):
+                    checksums[rel] = {"link": os.readlink(src)}
+                    os.symlink(os.readlink(src), dst)
+                    continue
+                h = hashlib.sha1()
+                with open(src, "rb") as fin, open(dst, "wb") as fout:
+                    for chunk in iter(lambda: fin.read(1 << 20), b""):
+                        h.update(chunk)
+                        fout.write(chunk)
+                shutil.copymode(src, dst)
+                st = os.stat(dst)
+                checksums[rel] = {"sha1": h.hexdigest(), "size": st.st_size, "mtime": st.st_mtime_ns}
+            with open(os.path.join(tmpDir, stageChecksums), "w") as f:
+                json.dump(checksums, f)
+            verified = self.verify(tmpDir, True)
+        except BaseException:
+            # Like a full disk, don't leave the partial copy behind
+            self.remove(tmpDir)
+            raise
+        if not verified:
+            self.remove(tmpDir)
+            logging.error("The staged copy of %s/%s doesn't match its checksums." % (self.cmpDir, self.simv))
+            raise Exception("<Stage Error> Staging the simv failed.")
+        subprocess.run(["chmod", "-R", "a-w", tmpDir])
+        os.rename(tmpDir, image)
+
+    def verify(self, image, content=False):
+        """
+        Check every file of a staged image against the size and mtime
+        recorded when it was copied.
+
+        Args:
+            image : directory of the staged image.
+            content : also check the content of every file against its
+                      checksum, done right after copying.
+
+        Returns:
+            True if the image is complete and unchanged.
+        """
+        try:
+            with open(os.path.join(image, stageChecksums), "r") as f:
+                checksums = json.load(f)
+        except (OSError, ValueError):
+            return False
+        for rel, record in checksums.items():
+            path = os.path.join(image, rel)
+            if not isinstance(record, dict):
+                # Image of an older vrun
+                return False
+            if "link" in record:
+                if not os.path.islink(path) or os.readlink(path) != record["link"]:
+                    return False
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                return False
+            if st.st_size != record["size"] or st.st_mtime_ns != record["mtime"]:
+                logging.warning("Staged file %s changed since it was copied." % path)
+                return False
+            if content and hashFile(path, {}) != record["sha1"]:
+                logging.warning("Staged file %s doesn't match its checksum." % path)
+                return False
+        return True
+
+    def remove(self, path):
+        if os.path.lexists(path):
+            subprocess.run(["chmod", "-R", "u+w", path])
+            subprocess.run(["rm", "-rf", path])
+
+    def cleanup(self, key):
+        """
+        Remove the images of other compiles no simulation of this host uses,
+        and the temporary copies of killed stagings.
+
+        Args:
+            key : key of the image in use, kept.
+
+        Returns:
+            Nothing
+        """
+        for entry in os.listdir(self.root):
+            if not entry.endswith(".lock") or entry == key + ".lock":
+                continue
+            image = os.path.join(self.root, entry[:-len(".lock")])
+            with open(os.path.join(self.root, entry), "a") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue
+                for name in os.listdir(self.root):
+                    if name.startswith(os.path.basename(image) + ".tmp"):
+                        self.remove(os.path.join(self.root, name))
+                if os.path.isdir(image):
+                    logging.info("Removing unused staged simv %s" % image)
+                    self.remove(image)
+
+
+class admissionCtrl(object):
+    """
+    Hold simulations back until the licenses, memory and cpus they need are free.
+
+    Every job needs "licenses" (default 1), "mem" in GB (default 0) and
+    "cpus" (default 1), as declared in its test entry. A job waits while
+    the total of the running jobs plus its own need exceeds a limit, or,
+    with watchHost, while the host load is too high or its free memory is
+    lower than the job needs. A job is always admitted when nothing runs.
+
+    Jobs are admitted first come first served: the job at the head of the
+    queue holds back the jobs behind it until it fits, so the resources it
+    waits for aren't taken by smaller jobs.
+    """
+    resources = ("licenses", "mem", "cpus")
+
+    def __init__(self, limits, watchHost=False, loadFactor=1.0, pollSecond=2.0):
+        self.limits = limits
+        self.watchHost = watchHost
+        self.loadFactor = loadFactor
+        self.pollSecond = pollSecond
+        self.used = dict.fromkeys(self.resources, 0)
+        self.running = 0
+        self.waiting = collections.deque()
+        self.cond = threading.Condition()
+
+    @staticmethod
+    def need(job):
+        return {"licenses": job.get("licenses", 1), "mem": job.get("mem", 0), "cpus": job.get("cpus", 1)}
+
+    def fits(self, need):
+        """
+        Check whether a job fits in the free resources, lock held.
+
+        Args:
+            need : resources needed by the job.
+
+        Returns:
+            True if the job can start now.
+        """
+        if self.running == 0:
+            return True
+        for res in self.resources:
+            if self.limits.get(res) is not None and self.used[res] + need[res] > self.limits[res]:
+                return False
+        if self.watchHost:
+            if os.getloadavg()[0] > (os.cpu_count() or 1) * self.loadFactor:
+                return False
+            memAvailable = hostMemory("MemAvailable")
+            if memAvailable is not None and memAvailable < need["mem"]:
+                return False
+        return True
+
+    def acquire(self, job, cancelled=None):
+        """
+        Wait until a job is at the head of the queue and can start, and
+        take its resources.
+
+        Args:
+            job : job to start.
+            cancelled : if set, called while the job waits, the job leaves
+                        the queue when it returns True.
+
+        Returns:
+            waited : seconds waited in the queue, None if the run was stopped.
+        """
+        need = self.need(job)
+        start = time.time()
+        ticket = object()
+        with self.cond:
+            self.waiting.append(ticket)
+            try:
+                if self.waiting[0] is not ticket or not self.fits(need):
+                    logging.info("Queued %s_%s, waiting for %s." % (job["test"], job["seed"],
+                                 ", ".join("%s %s" % (res, need[res]) for res in self.resources)))
+                while self.waiting[0] is not ticket or not self.fits(need):
+                    if stopEvent.is_set() or (cancelled is not None and cancelled()):
+                        return None
+                    self.cond.wait(self.pollSecond)
+                for res in self.resources:
+                    self.used[res] += need[res]
+                self.running += 1
+            finally:
+                # The next job in the queue may fit now
+                self.waiting.remove(ticket)
+                self.cond.notify_all()
+        return time.time() - start
+
+    def release(self, job):
+        """
+        Give back the resources of a finished job.
+
+        Args:
+            job : finished job.
+
+        Returns:
+            Nothing
+        """
+        need = self.need(job)
+        with self.cond:
+            for res in self.resources:
+                self.used[res] -= need[res]
+            self.running -= 1
+            self.cond.notify_all()
+
+
+class vrunDaemon(object):
+    """
+    Host wide vrun server on a Unix socket.
+
+    It keeps the flattened configs of its user and their resolved tests in
+    memory, checked against the mtime and size of their files on every
+    request, and it is the
+    admission control of the simulations of every vrun of the host using
+    it. A client holds the resources of a simulation while its acquire
+    connection is open, so a killed client gives them back.
+    """
+    def __init__(self, sockPath, limits, watchHost=False):
+        self.sockPath = sockPath
+        self.admission = admissionCtrl(limits, watchHost)
+        self.configs = {}
+        self.configLock = threading.Lock()
+
+    def serve(self):
+        """
+        Serve the clients until killed.
+
+        Returns:
+            Nothing
+        """
+        if os.path.exists(self.sockPath):
+            try:
+                daemonRequest(self.sockPath, {"op": "status"})
+            except OSError:
+                os.remove(self.sockPath)
+            else:
+                logging.error("A vrun daemon already listens on %s." % self.sockPath)
+                raise Exception("<Daemon Error> vrun daemon already running.")
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.sockPath)
+        os.chmod(self.sockPath, 0o666)
+        server.listen(128)
+        logging.info("vrun daemon listening on %s, limits %s" % (self.sockPath, self.admission.limits))
+        try:
+            while True:
+                conn = server.accept()[0]
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+        finally:
+            server.close()
+            os.remove(self.sockPath)
+
+    def handle(self, conn):
+        """
+        Answer the requests of one client connection.
+
+        Args:
+            conn : client connection.
+
+        Returns:
+            Nothing
+        """
+        uid = peerUid(conn)
+        reader = conn.makefile("r")
+        try:
+            for line in reader:
+                msg = json.loads(line)
+                if msg["op"] == "config":
+                    # Only the daemon user may read files through the daemon
+                    if uid != os.getuid():
+                        sendMsg(conn, {"error": "configs are served to uid %d only" % os.getuid()})
+                    else:
+                        env = clientEnv(msg["env"])
+                        try:
+                            entries = self.config(msg["cfg"], msg["cwd"], env, msg.get("tests"))
+                        except Exception as exc:
+                            if env.unsent:
+                                sendMsg(conn, {"needs": env.unsent})
+                            else:
+                                sendMsg(conn, {"error": "%s: %s" % (msg["cfg"], exc)})
+                        else:
+                            sendMsg(conn, {"entries": entries} if entries is not None else {"needs": env.unsent})
+                elif msg["op"] == "acquire":
+                    self.hold(conn, reader, msg["job"])
+                    return
+                elif msg["op"] == "status":
+                    with self.admission.cond:
+                        sendMsg(conn, {"running": self.admission.running, "waiting": len(self.admission.waiting),
+                                       "used": self.admission.used,
+                                       "limits": self.admission.limits, "configs": sorted(self.configs)})
+                else:
+                    sendMsg(conn, {"error": "unknown op %s" % msg["op"]})
+        except Exception as exc:
+            logging.warning("vrun daemon client uid %d: %s" % (uid, exc))
+        finally:
+            reader.close()
+            conn.close()
+
+    def config(self, cfg, cwd, env, tests=None):
+        """
+        Get the vcs entries and resolved tests of a config, flattening it
+        again when one of its files changed.
+
+        The tests are resolved with their extends chain by the testResolver
+        kept with the config, so a test is resolved once for all clients.
+        A client sends only the env vars asked for, when the imports use one
+        it didn't send, nothing is loaded nor cached.
+
+        Args:
+            cfg : absolute config YAML path.
+            cwd : work directory of the client.
+            env : environment of the client, a clientEnv noting the vars not sent.
+            tests : names of the tests to resolve, None for all.
+
+        Returns:
+            entries : vcs entries and resolved tests, without their extends,
+                      None if the imports need env vars not sent.
+        """
+        unsent = getattr(env, "unsent", [])
+        with self.configLock:
+            cache = self.configs.get(cfg)
+            if cache is not None:
+                # Ask for every env var of a loaded config in one go
+                for var in cache["env"]:
+                    env.get(var)
+            if (cache is None or not configCacheValid(cache, env, cwd)) and not unsent:
+                cache = buildConfigCache(cfg, env, cwd)
+                if not unsent:
+                    cache["resolver"] = testResolver([entry for entry in cache["entries"] if "test" in entry])
+                    self.configs[cfg] = cache
+                    logging.info("Loaded %s: %d entries from %d files"
+                                 % (cfg, len(cache["entries"]), len(cache["files"])))
+            if unsent:
+                return None
+            if tests is None:
+                tests = [entry["test"] for entry in cache["entries"] if "test" in entry]
+            entries = [entry for entry in cache["entries"] if "vcs" in entry]
+            for name in dict.fromkeys(tests):
+                test = dict(cache["resolver"].resolve(name))
+                test.pop("extends", None)
+                entries.append(test)
+            return entries
+
+    def hold(self, conn, reader, job):
+        """
+        Admit a simulation and hold its resources until the client closes
+        the connection.
+
+        Args:
+            conn : client connection.
+            reader : line reader of the connection.
+            job : resources needed, test and seed of the simulation.
+
+        Returns:
+            Nothing
+        """
+        # A client killed while waiting mustn't hold back the queue
+        waited = self.admission.acquire(job, lambda: clientGone(conn))
+        if waited is None:
+            return
+        try:
+            sendMsg(conn, {"waited": waited})
+            reader.read()
+        finally:
+            self.admission.release(job)
+
+
+class remoteAdmission(object):
+    """
+    Admission control of the simulations by the vrun daemon of the host,
+    in place of admissionCtrl.
+
+    Once the daemon can't be reached, the jobs are admitted by the local
+    fallback admissionCtrl for the rest of the run.
+    """
+    def __init__(self, sockPath, fallback, pollSecond=1.0):
+        self.sockPath = sockPath
+        self.fallback = fallback
+        self.pollSecond = pollSecond
+        self.held = {}
+        self.local = set()
+        self.lost = False
+        self.lock = threading.Lock()
+
+    def acquire(self, job):
+        """
+        Wait until the daemon admits a job.
+
+        Args:
+            job : job to start.
+
+        Returns:
+            waited : seconds waited in the queue, None if the run was stopped.
+        """
+        start = time.time()
+        if not self.lost:
+            try:
+                return self.acquireRemote(job)
+            except (OSError, ValueError) as exc:
+                with self.lock:
+                    if not self.lost:
+                        logging.warning("vrun daemon %s lost, admitting simulations here: %s" % (self.sockPath, exc))
+                    self.lost = True
+        waited = self.fallback.acquire(job)
+        with self.lock:
+            self.local.add(id(job))
+        return None if waited is None else waited + time.time() - start
+
+    def acquireRemote(self, job):
+        """
+        Wait until the daemon admits a job, for acquire.
+
+        Args:
+            job : job to start.
+
+        Returns:
+            waited : seconds waited in the queue, None if the run was stopped.
+        """
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(self.sockPath)
+            sendMsg(conn, {"op": "acquire", "job": dict(admissionCtrl.need(job), test=job["test"], seed=job["seed"])})
+            conn.settimeout(self.pollSecond)
+            reply = b""
+            while not reply.endswith(b"\n"):
+                try:
+                    data = conn.recv(4096)
+                except socket.timeout:
+                    if stopEvent.is_set():
+                        conn.close()
+                        return None
+                    continue
+                if not data:
+                    raise ConnectionError("vrun daemon closed the connection")
+                reply += data
+            waited = json.loads(reply)["waited"]
+        except BaseException:
+            conn.close()
+            raise
+        with self.lock:
+            self.held[id(job)] = conn
+        return waited
+
+    def release(self, job):
+        with self.lock:
+            conn = self.held.pop(id(job), None)
+            local = id(job) in self.local
+            self.local.discard(id(job))
+        if conn is not None:
+            conn.close()
+        if local:
+            self.fallback.release(job)
+
+
+def clientGone(conn):
+    """
+    Check whether the client of a connection closed it, without reading.
+
+    Args:
+        conn : client connection.
+
+    Returns:
+        True if the client closed the connection.
+    """
+    try:
+        return conn.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
+
+
+class clientEnv(dict):
+    """
+    Env vars sent by a daemon client, noting the ones asked for but not sent.
+
+    A var the client doesn't have is sent as None.
+    """
+    def __init__(self, env):
+        super().__init__(env)
+        self.unsent = []
+
+    def get(self, var, default=None):
+        if var not in self:
+            if var not in self.unsent:
+                self.unsent.append(var)
+            return default
+        return super().get(var)
+
+
+def peerUid(conn):
+    """
+    Get the uid of the process at the other end of a Unix socket.
+
+    Args:
+        conn : connected Unix socket.
+
+    Returns:
+        uid : uid of the peer.
+    """
+    return struct.unpack("3i", conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")))[1]
+
+
+def sendMsg(conn, msg):
+    conn.sendall((json.dumps(msg, default=str) + "\n").encode())
+
+
+def daemonRequest(sockPath, msg, tmoutSecond=10, owner=None):
+    """
+    Send one request to the vrun daemon.
+
+    Args:
+        sockPath : Unix socket of the daemon.
+        msg : request.
+        tmoutSecond : timeout of the connection.
+        owner : uid the daemon must run as, the request isn't sent to
+                another one, None to send it to any daemon.
+
+    Returns:
+        reply : reply of the daemon.
+    """
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.settimeout(tmoutSecond)
+    try:
+        conn.connect(sockPath)
+        if owner is not None and peerUid(conn) != owner:
+            raise ConnectionError("vrun daemon runs as uid %d, not as uid %d" % (peerUid(conn), owner))
+        sendMsg(conn, msg)
+        with conn.makefile("r") as reader:
+            line = reader.readline()
+    finally:
+        conn.close()
+    if not line:
+        raise ConnectionError("vrun daemon closed the connection")
+    return json.loads(line)
+
+
+class failBudget(object):
+    """
+    Stopping policies of a regression, checked before every job starts.
+
+    The regression stops after maxFails failures, a test stops after
+    testFails failures or once the same failure signature repeated
+    signatureStop times. The jobs not started then are skipped.
+    """
+    def __init__(self, maxFails=None, testFails=None, signatureStop=None):
+        self.maxFails = maxFails
+        self.testFails = testFails
+        self.signatureStop = signatureStop
+        self.fails = 0
+        self.failsOf = collections.Counter()
+        self.signatures = collections.Counter()
+        self.stopped = {}
+
+    def record(self, result):
+        """
+        Count a finished job against the budget.
+
+        Args:
+            result : result returned by runSim.
+
+        Returns:
+            Nothing
+        """
+        if result["status"] in ("PASS", "SKIP", "CMP_FAIL"):
+            return
+        test = result["test"]
+        self.fails += 1
+        self.failsOf[test] += 1
+        if self.maxFails is not None and self.fails == self.maxFails:
+            logging.error("Stopping the regression after %d failures." % self.fails)
+        if test in self.stopped:
+            return
+        if self.testFails is not None and self.failsOf[test] >= self.testFails:
+            self.stopped[test] = "%d failures" % self.failsOf[test]
+        elif self.signatureStop is not None:
+            signature = failureSignature(result)
+            self.signatures[(test, signature)] += 1
+            if self.signatures[(test, signature)] >= self.signatureStop:
+                self.stopped[test] = "%d failures with %s" % (self.signatures[(test, signature)], signature)
+        if test in self.stopped:
+            logging.error("Skipping the next jobs of %s after %s." % (test, self.stopped[test]))
+
+    def check(self, job):
+        """
+        Check if a job may still start.
+
+        Args:
+            job : job to start.
+
+        Returns:
+            reason : why the job is skipped, None to run it.
+        """
+        if self.maxFails is not None and self.fails >= self.maxFails:
+            return "regression stopped after %d failures" % self.fails
+        if job["test"] in self.stopped:
+            return "%s stopped after %s" % (job["test"], self.stopped[job["test"]])
+        return None
+
+
+def hostMemory(field="MemTotal"):
+    """
+    Read a memory field of /proc/meminfo.
+
+    Args:
+        field : field name, like MemTotal or MemAvailable.
+
+    Returns:
+        mem : the field in GB, None if it can't be read.
+    """
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024.0 / 1024.0
+    except OSError:
+        pass
+    return None
+
+
+class spanTracer(object):
+    """
+    Record timing spans of the script phases and commands.
+
+    Spans are exported in the Chrome trace event format, which chrome://tracing
+    and Perfetto open. A span also records the cpu time used by the waited
+    children and the peak RSS of the script and its children.
+    """
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    @contextlib.contextmanager
+    def span(self, name, cat="phase", usage=True, **spanArgs):
+        """
+        Time the code run in a with block.
+
+        Args:
+            name : span name.
+            cat : span category, like phase, cmd or sim.
+            usage : whether record the children cpu time and peak RSS, they
+                    are process wide and mix up spans run in parallel.
+            spanArgs : values shown with the span, the with block can add more
+                       to the yielded dict.
+
+        Returns:
+            Nothing
+        """
+        start = time.time()
+        childStart = resource.getrusage(resource.RUSAGE_CHILDREN)
+        try:
+            yield spanArgs
+        finally:
+            end = time.time()
+            if usage:
+                child = resource.getrusage(resource.RUSAGE_CHILDREN)
+                spanArgs.setdefault("child_cpu", round(child.ru_utime + child.ru_stime -
+                                                       childStart.ru_utime - childStart.ru_stime, 3))
+                spanArgs.setdefault("peak_rss_kb", max(child.ru_maxrss,
+                                                       resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+            event = {"name": name, "cat": cat, "ph": "X", "pid": self.pid, "tid": threading.get_native_id(),
+                     "ts": int(start * 1e6), "dur": int((end - start) * 1e6), "args": spanArgs}
+            with self.lock:
+                self.events.append(event)
+
+    def export(self, path):
+        """
+        Write the spans as a Chrome trace and log the slowest phases and tests.
+
+        Args:
+            path : trace file.
+
+        Returns:
+            Nothing
+        """
+        with self.lock:
+            events = list(self.events)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        logging.info("Profile written to %s" % path)
+        for cat, title in (("phase", "phases"), ("sim", "tests")):
+            spans = sorted([event for event in events if event["cat"] == cat], key=lambda event: -event["dur"])
+            if spans:
+                logging.info("Slowest %s:" % title)
+                for event in spans[:10]:
+                    logging.info("    %9.2fs  %s" % (event["dur"] / 1e6, event["name"]))
+
+
+class trashBatch(object):
+    """
+    Trash of the old output directories of the jobs of a run.
+
+    They are moved into one batch per trash directory while the run goes
+    on, and every batch is deleted by one background process when the run
+    ends, instead of one per directory.
+    """
+    def __init__(self):
+        self.batches = {}
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, path):
+        """
+        Move a path into the batch of the trash directory next to it.
+
+        Paths that can't be renamed, like mount points, are removed in place.
+
+        Args:
+            path : file or directory to remove.
+
+        Returns:
+            Nothing
+        """
+        trash = os.path.join(os.path.dirname(os.path.abspath(path)), trashDir)
+        with self.lock:
+            if trash not in self.batches:
+                os.makedirs(trash, exist_ok=True)
+                self.batches[trash] = tempfile.mkdtemp(dir=trash)
+            self.count += 1
+            target = os.path.join(self.batches[trash], "%d_%s" % (self.count, os.path.basename(path)))
+        try:
+            os.rename(path, target)
+        except OSError:
+            subprocess.run(["rm", "-rf", path])
+
+    def flush(self):
+        """
+        Delete the batches in the background, a new batch is started by the
+        next add.
+
+        Returns:
+            Nothing
+        """
+        with self.lock:
+            batches = list(self.batches.values())
+            self.batches = {}
+        if batches:
+            subprocess.Popen(["rm", "-rf"] + batches, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                             start_new_session=True)
 
 
 def parseArgs(cwd):
@@ -54,8 +1430,12 @@ def parseArgs(cwd):
                                             help="Output directory path.", dest="o")
     parser.add_argument("-v", "--verbose", type=str, default="UVM_LOW",
                                             help="The UVM verbose in simulation.", dest="v")
-    parser.add_argument("-time", "--timeout", type=int, default=300,
-                                            help="The command timeout limit.", dest="time")
+    parser.add_argument("-time", "--timeout", type=int, default=None,
+                                            help="The command timeout limit, overrides the YAML and history.", dest="time")
+    parser.add_argument("-tfactor", "--timeout_factor", type=float, default=None,
+                                            help="Time out tests at their p95 history time times this factor.", dest="tfactor")
+    parser.add_argument("-idle", "--idle_timeout", type=int, default=None,
+                                            help="Kill a simulation printing nothing for this many seconds.", dest="idle")
     parser.add_argument("-co", "--compile_only", action="store_true", default=False,
                                             help="Compile the generator only.", dest="co")
     parser.add_argument("-so", "--simulate_only", action="store_true", default=False,
@@ -68,16 +1448,85 @@ def parseArgs(cwd):
                                             help="Simulation options for the generator.", dest="sopt")
     parser.add_argument("-seed", "--seed", type=int, default=None,
                                             help="Randomize seed.", dest="seed")
+    parser.add_argument("-rseed", "--regr_seed", type=int, default=None,
+                                            help="Regression seed the test seeds are drawn from, random by default.", dest="rseed")
+    parser.add_argument("-maxfails", "--max_fails", type=int, default=None,
+                                            help="Skip the jobs not started yet after this many failures.", dest="maxfails")
+    parser.add_argument("-testfails", "--test_max_fails", type=int, default=None,
+                                            help="Skip the next jobs of a test after this many of its failures.", dest="testfails")
+    parser.add_argument("-sigstop", "--signature_stop", type=int, default=None,
+                                            help="Skip the next jobs of a test after its same failure signature this many times.", dest="sigstop")
     parser.add_argument("-iter", "--iterations", type=int, default=1,
                                             help="Test iterations.", dest="iter")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                                            help="Number of simulations to run in parallel.", dest="jobs")
+    parser.add_argument("-lic", "--licenses", type=int, default=None,
+                                            help="Simulation licenses available, no limit by default.", dest="lic")
+    parser.add_argument("-mem", "--mem_limit", type=float, default=None,
+                                            help="Memory in GB for simulations, the host memory by default.", dest="mem")
+    parser.add_argument("-cpus", "--cpu_limit", type=int, default=None,
+                                            help="Cpus for simulations, no limit by default.", dest="cpus")
+    parser.add_argument("-watch", "--watch_host", action="store_true", default=False,
+                                            help="Hold simulations while the host load or free memory is too high.", dest="watch")
+    parser.add_argument("-ff", "--fail_first", action="store_true", default=False,
+                                            help="Run the tests whose latest run failed first.", dest="ff")
+    parser.add_argument("-plan", "--plan", action="store_true", default=False,
+                                            help="Print the job order and predicted makespan without running.", dest="plan")
+    parser.add_argument("-maxerr", "--max_errors", type=int, default=None,
+                                            help="Kill a simulation at its first UVM_FATAL or after this many errors.", dest="maxerr")
     parser.add_argument("-vpd", "--vpd", action="store_true", default=False,
                                             help="Enable DVE vpd dump.", dest="vpd")
     parser.add_argument("-fsdb", "--fsdb", action="store_true", default=False,
                                             help="Enable Verdi fsdb dump.", dest="fsdb")
+    parser.add_argument("-wof", "--waves_on_fail", type=str, nargs="?", const="fsdb", default=None,
+                                            choices=["fsdb", "vpd"],
+                                            help="Rerun the failed jobs with waves, fsdb by default.", dest="wof")
+    parser.add_argument("-wscope", "--wave_scope", type=str, default=None,
+                                            help="Instance dumped in the waves, the top by default.", dest="wscope")
+    parser.add_argument("-wpre", "--wave_before", type=float, default=None,
+                                            help="Start the waves of -wof this many ns before the first error.", dest="wpre")
     parser.add_argument("-cov", "--cov", action="store_true", default=False,
                                             help="Enable code coverage collect.", dest="cov")
+    parser.add_argument("-covmerge", "--cov_merge", action="store_true", default=False,
+                                            help="Merge the coverage of passing tests in the background.", dest="covmerge")
+    parser.add_argument("-covcmd", "--cov_merge_cmd", type=str,
+                                            default="urg -full64 -noreport -dir {inputs} -dbname {output}",
+                                            help="Coverage merge command, with {inputs} and {output}.", dest="covcmd")
+    parser.add_argument("-covjobs", "--cov_merge_jobs", type=int, default=2,
+                                            help="Number of coverage merges running at the same time.", dest="covjobs")
+    parser.add_argument("-covtime", "--cov_merge_timeout", type=int, default=3600,
+                                            help="Timeout of every coverage merge command.", dest="covtime")
+    parser.add_argument("-stage", "--stage_dir", type=str, nargs="?", const="/tmp", default=None,
+                                            help="Run the simulations from a host local copy of the simv in this directory, /tmp by default.", dest="stage")
+    parser.add_argument("-passlogs", "--pass_logs", type=str, default="keep",
+                                            choices=["keep", "gzip", "zstd", "truncate"],
+                                            help="What to do with the sim.log of passing tests.", dest="passlogs")
     parser.add_argument("-clean", "--clean_output", action="store_true", default=False,
                                             help="Clean last run's output.", dest="clean")
+    parser.add_argument("-nocache", "--no_cache", action="store_true", default=False,
+                                            help="Ignore the compile and config caches.", dest="nocache")
+    parser.add_argument("-db", "--results_db", type=str, default=None,
+                                            help="Results database, <output>/vrun.db by default.", dest="db")
+    parser.add_argument("-query", "--query", type=str, default=None, choices=["failures", "flaky", "trends"],
+                                            help="Query the results database instead of running.", dest="query")
+    parser.add_argument("-days", "--days", type=float, default=7,
+                                            help="History window of -query in days.", dest="days")
+    parser.add_argument("-profile", "--profile", type=str, default=None,
+                                            help="Write the timing of every phase and command as a Chrome trace.", dest="profile")
+    parser.add_argument("-shard", "--shard", type=str, default=None,
+                                            help="Run shard I of N of the regression, as I/N.", dest="shard")
+    parser.add_argument("-shardplan", "--shard_plan", type=str, default=None,
+                                            help="Split of the shards, written by the first shard and read by the others.", dest="shardplan")
+    parser.add_argument("-merge", "--merge_shards", type=str, nargs="+", default=None,
+                                            help="Merge the run manifests of the shards into one report.", dest="merge")
+    parser.add_argument("-resume", "--resume", action="store_true", default=False,
+                                            help="Run the unfinished jobs of the latest run with their seeds.", dest="resume")
+    parser.add_argument("-rerun", "--rerun_failed", action="store_true", default=False,
+                                            help="Rerun the failed jobs of the latest run with their seeds.", dest="rerun")
+    parser.add_argument("-daemon", "--daemon", action="store_true", default=False,
+                                            help="Serve configs and admit the simulations of the host on -sock.", dest="daemon")
+    parser.add_argument("-sock", "--daemon_sock", type=str, default=os.environ.get("VRUN_SOCK"),
+                                            help="Unix socket of the vrun daemon, $VRUN_SOCK by default.", dest="sock")
     parser.add_argument("-st", "--show_tests", action="store_true", default=False,
                                             help="Show all test in this repo.", dest="st")
     parser.add_argument("-dstep", "--dve_step", action="store_true", default=False,
@@ -86,342 +1535,1713 @@ def parseArgs(cwd):
                                             help="Simulation in Verdi step mode.", dest="vstep")
     args = parser.parse_args()
 
-    if not args.cfg:
-        args.cfg = cwd + "/cfg/vcs.yaml"
-    if not os.path.isfile(args.cfg):
-        logging.error("Didn't find vcs script's config.")
-        raise Exception("<Config Error> Please check '--config' or '-cfg' option.")
-    if args.test is not None and args.regr is not None:
-        logging.error("Single case mode and Regression mode is not compatible.")
-        raise Exception("<Config Error> This Script can't have -test & -regr both.")
-    if not args.o:
-        args.o = cwd + "/out"
-    if args.co and args.so:
-        logging.error("--compile_only and --simulate_only is not compatible.")
-        raise Exception("<Config Error> This Script can't have -co & -so both.")
-    if args.seed is not None and args.seed < 0:
-        raise ValueError("<Config Error> Seed must be a non-negative integer.")
-    return args
+    if not args.cfg:
+        args.cfg = cwd + "/cfg/vcs.yaml"
+    if args.query is None and args.merge is None and not args.daemon and not os.path.isfile(args.cfg):
+        logging.error("Didn't find vcs script's config.")
+        raise Exception("<Config Error> Please check '--config' or '-cfg' option.")
+    if args.test is not None and args.regr is not None:
+        logging.error("Single case mode and Regression mode is not compatible.")
+        raise Exception("<Config Error> This Script can't have -test & -regr both.")
+    if not args.o:
+        args.o = cwd + "/out"
+    if args.co and args.so:
+        logging.error("--compile_only and --simulate_only is not compatible.")
+        raise Exception("<Config Error> This Script can't have -co & -so both.")
+    if args.seed is not None and args.seed < 0:
+        raise ValueError("<Config Error> Seed must be a non-negative integer.")
+    if args.jobs < 1:
+        raise ValueError("<Config Error> Jobs must be a positive integer.")
+    if args.rseed is not None and args.rseed < 0:
+        raise ValueError("<Config Error> Regression seed must be a non-negative integer.")
+    for limit in (args.maxfails, args.testfails, args.sigstop):
+        if limit is not None and limit < 1:
+            raise ValueError("<Config Error> Failure limits must be positive integers.")
+    if args.wof and (args.vpd or args.fsdb or args.dstep or args.vstep):
+        raise Exception("<Config Error> --waves_on_fail can't have -vpd, -fsdb, -dstep or -vstep.")
+    if args.wpre is not None and not args.wof:
+        raise Exception("<Config Error> --wave_before needs --waves_on_fail.")
+    if args.covmerge and not args.cov:
+        raise Exception("<Config Error> --cov_merge needs -cov.")
+    if args.covjobs < 1:
+        raise ValueError("<Config Error> Coverage merge jobs must be a positive integer.")
+    if args.maxerr is not None and args.maxerr < 1:
+        raise ValueError("<Config Error> Max errors must be a positive integer.")
+    if args.shard is not None:
+        match = re.match(r"^(\d+)/(\d+)$", args.shard)
+        if match is None or not 1 <= int(match.group(1)) <= int(match.group(2)):
+            raise ValueError("<Config Error> Shard must be I/N with 1 <= I <= N.")
+        if args.regr is None:
+            raise Exception("<Config Error> --shard needs -regr.")
+        if args.shardplan is None:
+            logging.error("Every shard must run from the same split, written once to the --shard_plan file.")
+            raise Exception("<Config Error> --shard needs --shard_plan.")
+        args.shard = (int(match.group(1)), int(match.group(2)))
+    if args.resume and args.rerun:
+        raise Exception("<Config Error> This Script can't have --resume & --rerun_failed both.")
+    if (args.resume or args.rerun) and (args.test is not None or args.regr is not None):
+        logging.error("--resume and --rerun_failed run the jobs of the latest run.")
+        raise Exception("<Config Error> This Script can't have -test or -regr with --resume or --rerun_failed.")
+    if (args.resume or args.rerun) and (args.clean or args.co):
+        raise Exception("<Config Error> This Script can't have -clean or -co with --resume or --rerun_failed.")
+    return args
+
+
+def runCmd(cmd, tmoutSecond=600, exitOnError=True, cwd=None, stream=False, onLine=None,
+           logFile=None, tailLines=100, stats=None, idleSecond=None):
+    """
+    Run command with timeout limit and return output.
+
+    In stream mode the output is read line by line while the command runs,
+    written to logFile and only its last tailLines lines are kept, so the
+    memory used doesn't depend on the output size. On timeout the whole
+    process group of the command is killed.
+
+    Args:
+        cmd : command to run.
+        tmoutSecond : timeout in second.
+        exitOnError : whether exit the script when command errors.
+        cwd : work directory of the command, current directory if None.
+        stream : whether read the output incrementally, implied by onLine
+                 and logFile.
+        onLine : if set, called with every output line as soon as it is
+                 produced, the command is killed when it returns True.
+        logFile : if set, file the output is written to as it is produced.
+        tailLines : number of last output lines returned in stream mode.
+        stats : if set, filled with rc, start, end and wall time of the
+                command, and in stream mode its cpu time and maxrss (KB).
+                "killReason" is set to TIMEOUT or HANG when it is killed,
+                or to SIGNAL when a signal vrun didn't send ended it.
+        idleSecond : in stream mode, kill the command when it printed
+                     nothing for this many seconds, None for no limit.
+
+    Return :
+        output : command output, only its last tailLines lines in stream mode.
+    """
+    logging.info(cmd)
+    if stats is None:
+        stats = {}
+    with tracer.span(cmd.split()[0], "cmd", cmd=cmd) as spanArgs:
+        try:
+            return runCmdStats(cmd, tmoutSecond, exitOnError, cwd, stream, onLine, logFile, tailLines, stats,
+                               idleSecond)
+        finally:
+            spanArgs["rc"] = stats.get("rc")
+            if stats.get("cpu") is not None:
+                spanArgs["child_cpu"] = round(stats["cpu"], 3)
+                spanArgs["peak_rss_kb"] = stats["maxrss"]
+
+
+def runCmdStats(cmd, tmoutSecond, exitOnError, cwd, stream, onLine, logFile, tailLines, stats, idleSecond):
+    """
+    Run command for runCmd, which times it.
+
+    Args:
+        see runCmd.
+
+    Return :
+        output : command output.
+    """
+    start = time.time()
+    usage = None
+    aborted = False
+    try:
+        ps = subprocess.Popen(
+            "exec " + cmd,
+            shell=True,
+            executable='/bin/bash',
+            universal_newlines=True,
+            errors="replace",
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=cwd,
+            start_new_session=True
+        )
+    except subprocess.CalledProcessError:
+        logging.error(ps.commuicate()[0])
+        raise Exception("<Command Error> Subprocess running failed.")
+    except KeyboardInterrupt:
+        logging.debug("\nExited Ctrl-C from user request.")
+        raise KeyboardInterrupt("<Keyboard Error> Exited Ctrl+C from user request.")
+    with procLock:
+        activeProcs.add(ps)
+    try:
+        if not (stream or onLine or logFile):
+            output = ps.communicate(timeout=tmoutSecond)[0]
+        else:
+            tail = collections.deque(maxlen=tailLines)
+            finished = threading.Event()
+            lastOutput = [start]
+            def watchdog():
+                while True:
+                    deadline = start + tmoutSecond
+                    if idleSecond is not None:
+                        deadline = min(deadline, lastOutput[0] + idleSecond)
+                    if finished.wait(max(deadline - time.time(), 0.05)):
+                        return
+                    now = time.time()
+                    if now >= start + tmoutSecond:
+                        stats["killReason"] = "TIMEOUT"
+                    elif idleSecond is not None and now >= lastOutput[0] + idleSecond:
+                        stats["killReason"] = "HANG"
+                    else:
+                        continue
+                    killGroup(ps)
+                    return
+            timer = threading.Thread(target=watchdog, daemon=True)
+            timer.start()
+            lf = open(logFile, "w") if logFile else None
+            try:
+                for line in ps.stdout:
+                    lastOutput[0] = time.time()
+                    tail.append(line)
+                    if lf is not None:
+                        lf.write(line)
+                    if onLine is not None and onLine(line):
+                        logging.info("Aborted: %s" % cmd)
+                        aborted = True
+                        killGroup(ps)
+                        break
+                ps.stdout.close()
+                try:
+                    waitStatus, usage = os.wait4(ps.pid, 0)[1:]
+                    ps.returncode = os.waitstatus_to_exitcode(waitStatus)
+                except ChildProcessError:
+                    ps.wait()
+            finally:
+                finished.set()
+                if lf is not None:
+                    lf.close()
+            output = "".join(tail)
+            if stats.get("killReason") == "TIMEOUT":
+                raise subprocess.TimeoutExpired(cmd, tmoutSecond)
+            if stats.get("killReason") == "HANG":
+                logging.error("Hang[no output for %ds]: %s" % (idleSecond, cmd))
+                raise Exception("<Command Error> Subprocess hang.")
+    except subprocess.TimeoutExpired:
+        logging.error("Timeout[%ds]: %s"%(tmoutSecond, cmd))
+        stats["killReason"] = "TIMEOUT"
+        killGroup(ps)
+        ps.wait()
+        raise Exception("<Command Error> Subprocess timeout.")
+    finally:
+        with procLock:
+            activeProcs.discard(ps)
+        stats["rc"] = ps.returncode
+        stats["start"] = start
+        stats["end"] = time.time()
+        stats["wall"] = stats["end"] - start
+        stats["cpu"] = usage.ru_utime + usage.ru_stime if usage else None
+        stats["maxrss"] = usage.ru_maxrss if usage else None
+    rc = ps.returncode
+    if rc and rc < 0 and not aborted and not stopEvent.is_set():
+        # Killed by a signal vrun didn't send, like a crash or an OOM kill
+        stats["killReason"] = "SIGNAL"
+        logging.error(output)
+        logging.error("Killed by %s: %s" % (signalName(-rc), cmd))
+        if logFile:
+            logging.error("Whole output: %s" % logFile)
+        if exitOnError:
+            raise Exception("<Command Error> Subprocess killed by %s." % signalName(-rc))
+    elif rc and rc > 0:
+        logging.error(output)
+        logging.error("Error return code: %s"%rc)
+        if logFile:
+            logging.error("Whole output: %s" % logFile)
+        if exitOnError:
+            raise Exception("<Command Error> Subprocess running failed with return code: %s."%rc)
+    else:
+        logging.debug(output)
+    return output
+
+
+def signalName(signum):
+    """
+    Get the name of a signal.
+
+    Args:
+        signum : signal number.
+
+    Returns:
+        name : like SIGSEGV, the number if it isn't a known signal.
+    """
+    try:
+        return signal.Signals(signum).name
+    except ValueError:
+        return "signal %d" % signum
+
+
+def killActive():
+    """
+    Kill all commands still running, used when the user stops the script.
+
+    Every command runs in its own session, so the whole process group is
+    killed and no simulator child is left behind.
+
+    Returns:
+        Nothing
+    """
+    with procLock:
+        procs = list(activeProcs)
+    for ps in procs:
+        logging.info("Killing pid %d" % ps.pid)
+        killGroup(ps)
+
+
+def killGroup(ps):
+    """
+    Kill the process group of a command started by runCmd.
+
+    Args:
+        ps : Popen object of the command.
+
+    Returns:
+        Nothing
+    """
+    try:
+        os.killpg(ps.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def readYaml(yamlFile):
+    """
+    Read YAML file to a dictionary
+
+    Args:
+        yamlFile : YAML file
+
+    Returns:
+        yamlData : data read from YAML in dictionary format
+    """
+    with open(yamlFile, "r") as f:
+            try:
+                    yamlData = yaml.load(f, Loader=yamlLoader)
+            except yaml.YAMLError as exc:
+                    logging.error(exc)
+                    raise Exception("<YAML Error> YAML data error.")
+    return yamlData
+
+
+def createOutput(output, clean, prefix="out_"):
+    """
+    Create output directory
+
+    Args:
+        output : Name of specified output directory
+        noclean: Do not clean the output of the previous runs
+
+    Returns:
+        Output directory
+    """
+    # Create output directory
+    if output is None:
+        output = prefix + str(datetime.date.today())
+    if clean is True and os.path.lexists(output):
+        runTrash.add(output)
+
+    logging.info("Creating output directory: %s" % output)
+    os.makedirs(output, exist_ok=True)
+    return output
+
+
+def discardOutput(paths, trash):
+    """
+    Move paths into a new batch of the trash directory and delete the
+    batch in the background.
+
+    Paths that can't be renamed, like mount points, are removed in place.
+
+    Args:
+        paths : files or directories to remove.
+        trash : trash directory, on the same file system as the paths.
+
+    Returns:
+        batch : trash batch directory being deleted.
+    """
+    os.makedirs(trash, exist_ok=True)
+    batch = tempfile.mkdtemp(dir=trash)
+    for i, path in enumerate(paths):
+        try:
+            os.rename(path, os.path.join(batch, "%d_%s" % (i, os.path.basename(path))))
+        except OSError:
+            subprocess.run(["rm", "-rf", path])
+    subprocess.Popen(["rm", "-rf", batch], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+    return batch
+
+
+def cleanOutput(output, keep):
+    """
+    Remove the results of the previous runs from the output directory.
+
+    Args:
+        output : output directory.
+        keep : entries of the output directory to keep, as glob patterns.
+
+    Returns:
+        Nothing
+    """
+    if not os.path.isdir(output):
+        return
+    entries = [os.path.join(output, entry) for entry in os.listdir(output)
+               if not any(fnmatch.fnmatchcase(entry, pattern) for pattern in keep) and entry != trashDir]
+    if entries:
+        logging.info("Cleaning %d entries of %s in the background" % (len(entries), output))
+        discardOutput(entries, os.path.join(output, trashDir))
+    # Batches left by runs killed before their deletion ended
+    trash = os.path.join(output, trashDir)
+    if os.path.isdir(trash):
+        leftovers = [os.path.join(trash, entry) for entry in os.listdir(trash)]
+        if leftovers:
+            subprocess.Popen(["rm", "-rf"] + leftovers, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                             start_new_session=True)
+
+
+def flattenConfig(cfg, entries, files, envVars, relImports, env=None, cwd=None):
+    """
+    Read a config YAML and its imports into one flat entry list.
+
+    Every file is parsed once, a file imported again is skipped.
+
+    Args:
+        cfg : config YAML path.
+        entries : vcs and test entries found, in config order.
+        files : absolute path of every YAML file read.
+        envVars : env vars used by the import paths.
+        relImports : import paths relative to the work directory.
+        env : environment the import paths are expanded with, os.environ if None.
+        cwd : work directory of relative paths, the current directory if None.
+
+    Returns:
+        Nothing
+    """
+    if env is None:
+        env = os.environ
+    cfgPath = os.path.normpath(os.path.join(cwd or os.getcwd(), cfg))
+    if cfgPath in files:
+        logging.debug("Skipping %s, already imported." % cfg)
+        return
+    files.append(cfgPath)
+    yamlData = readYaml(cfgPath) or []
+    for entry in yamlData:
+        if "import" in entry:
+            for var in re.findall(r"\$\{?(\w+)", entry["import"]):
+                envVars[var] = env.get(var)
+            importPath = expandVars(entry["import"], env)
+            if not os.path.isabs(importPath):
+                relImports.append(importPath)
+            flattenConfig(importPath, entries, files, envVars, relImports, env, cwd)
+        elif "vcs" in entry or "test" in entry:
+            entries.append(entry)
+
+
+def expandVars(text, env):
+    """
+    Expand $VAR and ${VAR} like os.path.expandvars, from another environment.
+
+    Args:
+        text : text to expand.
+        env : environment of the variables, unknown ones are left as they are.
+
+    Returns:
+        text : expanded text.
+    """
+    def expand(m):
+        value = env.get(m.group(1) or m.group(2))
+        return m.group(0) if value is None else value
+    return envVarRe.sub(expand, text)
+
+
+def configCacheFile(cfg):
+    """
+    Get the path of the on-disk cache of a flattened config.
+
+    Args:
+        cfg : config YAML path.
+
+    Returns:
+        path : cache file under $XDG_CACHE_HOME/vrun or ~/.cache/vrun.
+    """
+    cacheDir = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    cfgHash = hashlib.sha1(os.path.abspath(cfg).encode()).hexdigest()
+    return os.path.join(cacheDir, "vrun", "config_%s.pickle" % cfgHash)
+
+
+def fileStats(files):
+    """
+    Get the mtime and size of files.
+
+    Args:
+        files : file paths.
+
+    Returns:
+        stats : [path, mtime_ns, size] of every file, None for a missing one.
+    """
+    stats = []
+    for path in files:
+        try:
+            st = os.stat(path)
+            stats.append([path, st.st_mtime_ns, st.st_size])
+        except OSError:
+            stats.append([path, None, None])
+    return stats
+
+
+def loadConfigEntries(cfg, useCache=True):
+    """
+    Get the flattened entries of a config, from the cache when it is valid.
+
+    The cache is valid while no file of the import graph changed its mtime
+    or size, and the env vars used by the imports are the same.
+
+    Args:
+        cfg : config YAML path.
+        useCache : whether read the cache, it is always written.
+
+    Returns:
+        entries : vcs and test entries of the config.
+    """
+    cacheFile = configCacheFile(cfg)
+    if useCache:
+        try:
+            with open(cacheFile, "rb") as f:
+                cache = pickle.load(f)
+            if configCacheValid(cache, os.environ, os.getcwd()):
+                logging.info("Loaded config from cache: %s" % cacheFile)
+                return cache["entries"]
+        except (OSError, EOFError, KeyError, TypeError, pickle.UnpicklingError):
+            pass
+    cache = buildConfigCache(cfg)
+    try:
+        os.makedirs(os.path.dirname(cacheFile), exist_ok=True)
+        tmpFile = "%s.%d.tmp" % (cacheFile, os.getpid())
+        with open(tmpFile, "wb") as f:
+            pickle.dump(cache, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpFile, cacheFile)
+    except OSError as exc:
+        logging.warning("Failed to write config cache: %s" % exc)
+    return cache["entries"]
+
+
+def buildConfigCache(cfg, env=None, cwd=None):
+    """
+    Flatten a config and record what its entries depend on.
+
+    Args:
+        cfg : config YAML path.
+        env : environment of the run, os.environ if None.
+        cwd : work directory of the run, the current directory if None.
+
+    Returns:
+        cache : entries with the stats of their files, the env vars used
+                and the work directory of relative imports.
+    """
+    entries = []
+    files = []
+    envVars = {}
+    relImports = []
+    flattenConfig(cfg, entries, files, envVars, relImports, env, cwd)
+    return {"version": configCacheVersion, "files": fileStats(files), "env": envVars,
+            "cwd": (cwd or os.getcwd()) if relImports else None, "entries": entries}
+
+
+def configCacheValid(cache, env, cwd):
+    """
+    Check a flattened config against its files, env vars and work directory.
+
+    Args:
+        cache : flattened config from buildConfigCache.
+        env : environment of the run.
+        cwd : work directory of the run.
+
+    Returns:
+        True if the entries are still up to date.
+    """
+    return cache["version"] == configCacheVersion \
+        and fileStats([stat[0] for stat in cache["files"]]) == cache["files"] \
+        and all(env.get(var) == cache["env"][var] for var in cache["env"]) \
+        and cache["cwd"] in (None, cwd)
+
+
+def loadConfig(args, cfg, builds, testList):
+    """
+    Extract script config from YAML.
+
+    Every vcs entry is a build named by its "build", "default" if it has
+    none. Tests pick the build they need by their "build". Through the
+    vrun daemon, the test list only has the tests of the run, resolved.
+
+    Args :
+        args : command line parser.
+        builds : build name to its vcs options data.
+        testList : test list extracted from YAML.
+
+    Returns :
+        Nothing
+    """
+    entries = None
+    if args.sock is not None and not args.nocache:
+        # The daemon resolves the tests of the run, the others aren't sent
+        tests = []
+        if args.st:
+            tests = None
+        elif args.test is not None:
+            tests = [args.test]
+        elif args.regr is not None:
+            regrList = []
+            loadRegrList(args.regr, regrList)
+            tests = [entry["test"] for entry in regrList]
+        # Only the env vars the imports use are sent, as the daemon asks for them
+        env = {}
+        try:
+            while entries is None:
+                reply = daemonRequest(args.sock, {"op": "config", "cfg": os.path.abspath(cfg), "cwd": os.getcwd(),
+                                                  "env": env, "tests": tests}, owner=os.getuid())
+                entries = reply.get("entries")
+                needs = [var for var in reply.get("needs", []) if var not in env]
+                if entries is None and not needs:
+                    logging.warning("vrun daemon: %s" % reply.get("error"))
+                    break
+                env.update((var, os.environ.get(var)) for var in needs)
+        except OSError as exc:
+            logging.warning("vrun daemon %s not reachable, loading the config here: %s" % (args.sock, exc))
+    if entries is None:
+        entries = loadConfigEntries(cfg, not args.nocache)
+    for entry in entries:
+        if "vcs" in entry:
+            name = str(entry.get("build", defaultBuild))
+            if name in builds:
+                logging.error("Found more than 1 vcsOpts entry of build %s in config." % name)
+                raise Exception("<YAML Error> More than 1 vcsOpts of build %s in YAML." % name)
+            vcsOpts = dict(entry)
+            builds[name] = vcsOpts
+            if "flist" not in entry:
+                logging.error("Didn't find flist in vcsOpts.")
+                raise Exception("<YAML Error> Didn't find flist in YAML.")
+            # Compile options
+            cmpOpts = ""
+            if args.copt is not None:
+                cmpOpts += " " + args.copt
+            elif "cmp_opts" in entry:
+                cmpOpts += " " + entry["cmp_opts"]
+            vcsOpts["cmp_opts"] = cmpOpts
+            # Elaboration options
+            elabOpts = ""
+            if args.eopt is not None:
+                elabOpts += " " + args.eopt
+            elif "elab_opts" in entry:
+                elabOpts += " " + entry["elab_opts"]
+            vcsOpts["elab_opts"] = elabOpts
+            vcsOpts["cov"] = args.cov or bool(entry.get("cov"))
+        elif "test" in entry:
+            testList.append(entry)
+
+
+def getEnvVar(var):
+    """
+    Get the value of environment variable
+
+    Args:
+        var : Name of the environment variable
+
+    Returns:
+        val : Value of the environment variable
+    """
+    try:
+        val = os.environ[var]
+    except KeyError:
+        logging.warning("Please set the environment variable {}".format(var))
+        raise KeyError("<Key Error> Didn't find environment value with key {}.".format(var))
+    return val
+
+
+def loadRegrList(regr, regrList):
+    """
+    Extract regression list from file.
+
+    Args:
+        regr : regression list path.
+        regrList : test list extracted from regression list.
+
+    Returns :
+        Nothing
+    """
+    yamlData = readYaml(regr)
+    for entry in yamlData:
+        if "test" in entry:
+            regrList.append(entry)
+
+
+def expandBraces(text):
+    """
+    Expand bash style braces, "a/{b,c}" gives ["a/b", "a/c"].
+
+    Args:
+        text : text to expand.
+
+    Returns:
+        expanded : list of expanded text.
+    """
+    match = re.search(r"\{([^{}]*,[^{}]*)\}", text)
+    if match is None:
+        return [text]
+    expanded = []
+    for part in match.group(1).split(","):
+        expanded.extend(expandBraces(text[:match.start()] + part + text[match.end():]))
+    return expanded
+
+
+def splitFlist(text):
+    """
+    Split file list text into tokens, with env vars, braces and comments resolved.
+
+    Args:
+        text : file list text.
+
+    Returns:
+        tokens : list of tokens.
+    """
+    tokens = []
+    for line in os.path.expandvars(text).splitlines():
+        line = line.split("//")[0]
+        for token in shlex.split(line, comments=True):
+            tokens.extend(expandBraces(token))
+    return tokens
+
+
+def resolveFlist(text, cwd, fileSet, dirSet):
+    """
+    Find every file and include directory a file list refers to.
+
+    Args:
+        text : file list text.
+        cwd : directory relative paths are resolved from.
+        fileSet : source and -f/-v files found.
+        dirSet : +incdir+ and -y directories found.
+
+    Returns:
+        Nothing
+    """
+    tokens = splitFlist(text)
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token.startswith("+incdir+"):
+            for incdir in token[len("+incdir+"):].split("+"):
+                if incdir != "":
+                    dirSet.add(os.path.normpath(os.path.join(cwd, incdir)))
+        elif token in ("-f", "-F", "-v", "-y") and i + 1 < len(tokens):
+            i += 1
+            path = os.path.normpath(os.path.join(cwd, tokens[i]))
+            if token == "-y":
+                dirSet.add(path)
+            elif path not in fileSet:
+                fileSet.add(path)
+                if token != "-v" and os.path.isfile(path):
+                    with open(path, "r") as f:
+                        subCwd = os.path.dirname(path) if token == "-F" else cwd
+                        resolveFlist(f.read(), subCwd, fileSet, dirSet)
+        elif not token.startswith("+") and not token.startswith("-"):
+            fileSet.add(os.path.normpath(os.path.join(cwd, token)))
+        i += 1
+
+
+def hashFile(path, statCache):
+    """
+    Hash file content, reusing the digest while its mtime and size are unchanged.
+
+    Args:
+        path : file path.
+        statCache : path to [mtime_ns, size, digest] of files hashed before.
+
+    Returns:
+        digest : content hash, "missing" if the file doesn't exist.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return "missing"
+    cached = statCache.get(path)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    statCache[path] = [st.st_mtime_ns, st.st_size, digest]
+    return digest
+
+
+def compileInputs(args, vcsOpts, cmds, cmpDir, statCache, inputs):
+    """
+    Collect the digest of everything the compile result depends on.
+
+    Args:
+        args : command line parser.
+        vcsOpts : vcs options data.
+        cmds : name to command line of the vlogan and vcs commands.
+        cmpDir : compile directory.
+        statCache : path to [mtime_ns, size, digest] of files hashed before.
+        inputs : input name to digest.
+
+    Returns:
+        Nothing
+    """
+    inputs["flist"] = os.path.expandvars(vcsOpts["flist"])
+    inputs["cmp_opts"] = vcsOpts["cmp_opts"]
+    inputs["elab_opts"] = vcsOpts["elab_opts"]
+    inputs["cov"] = str(vcsOpts["cov"])
+    for name in cmds:
+        inputs[name] = os.path.expandvars(cmds[name])
+    fileSet = set()
+    dirSet = set()
+    resolveFlist(vcsOpts["flist"], cmpDir, fileSet, dirSet)
+    for incdir in dirSet:
+        try:
+            entries = list(os.scandir(incdir))
+        except OSError:
+            inputs["dir:" + incdir] = "missing"
+            continue
+        for entry in entries:
+            if entry.is_file() and os.path.splitext(entry.name)[1] in hdlExts:
+                fileSet.add(entry.path)
+    for path in fileSet:
+        inputs["file:" + path] = hashFile(path, statCache)
+    for path in list(statCache):
+        if path not in fileSet:
+            del statCache[path]
+
+
+def loadCompileCache(cmpDir):
+    """
+    Read the record of the last compile in cmpDir.
+
+    Args:
+        cmpDir : compile directory.
+
+    Returns:
+        cache : inputs and file stats of the last compile, empty if none.
+    """
+    try:
+        with open(cmpDir+"/vrun_cache.json", "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def checkCompileCache(cmpDir, cache, inputs):
+    """
+    Check whether the last compile in cmpDir was done from the same inputs.
+
+    Args:
+        cmpDir : compile directory.
+        cache : record of the last compile.
+        inputs : input name to digest of this run.
+
+    Returns:
+        True if the compiled simv can be reused.
+    """
+    if "inputs" not in cache:
+        logging.info("Compile cache miss: no previous compile in %s." % cmpDir)
+        return False
+    if not os.path.isfile(cmpDir+"/vcs.simv"):
+        logging.info("Compile cache miss: vcs.simv doesn't exist.")
+        return False
+    oldInputs = cache["inputs"]
+    changed = []
+    for name in sorted(set(oldInputs) | set(inputs)):
+        if name not in oldInputs:
+            changed.append("added %s" % name)
+        elif name not in inputs:
+            changed.append("removed %s" % name)
+        elif oldInputs[name] != inputs[name]:
+            changed.append("changed %s" % name)
+    if changed:
+        logging.info("Compile cache miss: %d inputs changed." % len(changed))
+        for change in changed[:20]:
+            logging.info("    %s" % change)
+        if len(changed) > 20:
+            logging.info("    ... and %d more" % (len(changed) - 20))
+        return False
+    return True
+
+
+def saveCompileCache(cmpDir, inputs, statCache):
+    """
+    Record the inputs of a successful compile.
+
+    Args:
+        cmpDir : compile directory.
+        inputs : input name to digest.
+        statCache : path to [mtime_ns, size, digest] of the hashed files.
+
+    Returns:
+        Nothing
+    """
+    key = hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+    tmpFile = cmpDir+"/vrun_cache.json.tmp"
+    with open(tmpFile, "w") as f:
+        json.dump({"key": key, "inputs": inputs, "stats": statCache}, f)
+    os.replace(tmpFile, cmpDir+"/vrun_cache.json")
+
+
+def compileBuild(args, name, vcsOpts, outputDir, usage=True):
+    """
+    Compile one build into its compile directory, unless its compile cache hits.
+
+    Args:
+        args : command line parser.
+        name : build name.
+        vcsOpts : vcs options data of the build, with its "cmp_dir" and "cov_dir".
+        outputDir : output directory.
+        usage : whether the spans record the children cpu time, False when
+                builds compile in parallel.
+
+    Returns:
+        Nothing
+    """
+    cmp_output = vcsOpts["cmp_dir"]
+    vloganUvmCmd = ("vlogan -full64 -sverilog -lca -ntb_opts uvm-1.2 -timescale=%s -kdb "
+                                "-l %s/vlogan.log" % (timescale, cmp_output))
+    vcsCmd = ("vcs -full64 -sverilog -lca -ntb_opts uvm-1.2 -partcomp -kdb "
+                         "-CFLAGS '--std=c99 -fno-extended-identifiers' "
+                         "-LDFLAGS '-Wl,--no-as-needed' -debug_acc+all "
+                         "-l %s/vcs.log -o %s/vcs.simv" % (cmp_output, cmp_output))
+    cmpTimeout = args.time or vcsOpts.get("cmp_timeout") or defaultTimeout
+    vloganCmd = vloganUvmCmd + " " + vcsOpts["flist"].strip("\n") + vcsOpts["cmp_opts"]
+    vcsCmd = vcsCmd + " -top %s" % vcsOpts["top"].strip("\n") + vcsOpts["elab_opts"]
+    if vcsOpts["cov"]:
+        vcsCmd += " -cm line+tgl+fsm+cond+branch+assert -cm_cond allops -cm_dir %s" % vcsOpts["cov_dir"]
+    cache = loadCompileCache(cmp_output)
+    statCache = cache.get("stats", {})
+    inputs = {}
+    cmds = {"vlogan_uvm_cmd": vloganUvmCmd, "vlogan_cmd": vloganCmd, "vcs_cmd": vcsCmd}
+    with tracer.span("compileCache", usage=usage, build=name):
+        compileInputs(args, vcsOpts, cmds, cmp_output, statCache, inputs)
+        cacheHit = not args.nocache and checkCompileCache(cmp_output, cache, inputs)
+    if cacheHit:
+        logging.info("------ Compile of %s is up to date, reusing %s/vcs.simv ------" % (name, cmp_output))
+        testData = vcsOpts["cov_dir"]+"/snps/coverage/db/testdata"
+        if args.clean and os.path.isdir(testData):
+            # Keep the compile time model only, the coverage of the last run's tests goes
+            discardOutput([testData], outputDir+"/"+trashDir)
+        return
+    if args.clean:
+        discardOutput([path for path in (cmp_output, vcsOpts["cov_dir"])
+                       if os.path.lexists(path) and not path.startswith(cmp_output+"/")],
+                      outputDir+"/"+trashDir)
+    createOutput(cmp_output, False)
+    # A compile that doesn't finish mustn't leave the last simv looking up to date
+    for stale in ("vrun_cache.json", "vcs.simv"):
+        if os.path.lexists(cmp_output+"/"+stale):
+            os.remove(cmp_output+"/"+stale)
+
+    def step(title, cmd, logName):
+        # Ctrl-C stops the compile between its steps too
+        if stopEvent.is_set():
+            raise Exception("<Command Error> Compile of %s stopped before %s." % (name, title))
+        stats = {}
+        with tracer.span(title, usage=usage, build=name):
+            runCmd(cmd, cmpTimeout, cwd=cmp_output, logFile=cmp_output+"/"+logName, stats=stats)
+        if stopEvent.is_set():
+            raise Exception("<Command Error> Compile of %s stopped after %s." % (name, title))
+        if stats["rc"] != 0:
+            # Killed by vrun itself
+            logging.error("%s of %s ended with return code %s." % (title, name, stats["rc"]))
+            raise Exception("<Command Error> %s of %s failed." % (title, name))
+
+    logging.info("------ Starting vlogan UVM of %s ------" % name)
+    step("vlogan UVM", vloganUvmCmd, "vlogan_uvm.out")
+    logging.info("------ Starting vlogan of %s ------" % name)
+    with open(cmp_output+"/vlogan.sh", "w") as f:
+        f.write(vloganCmd)
+    step("vlogan", vloganCmd, "vlogan.out")
+    logging.info("------ Finished ------")
+    logging.info("------ Starting vcs of %s ------" % name)
+    with open(cmp_output+"/vcs.sh", "w") as f:
+        f.write(vcsCmd)
+    step("vcs", vcsCmd, "vcs.out")
+    if not os.path.isfile(cmp_output+"/vcs.simv"):
+        logging.error("vcs of %s didn't write %s/vcs.simv." % (name, cmp_output))
+        raise Exception("<Command Error> vcs of %s failed." % name)
+    logging.info("------ Finished ------")
+    saveCompileCache(cmp_output, inputs, statCache)
+
+
+def processVCS(args, builds, jobList, outputDir, listeners=(), db=None):
+    """
+    Compile the builds the jobs need in parallel and run the simulations.
+
+    The simulations of a build start as soon as its compile is done, while
+    the other builds still compile. A build compiles into compile_<build>,
+    or into compile when the config has one build only.
+
+    Args:
+        args : command line parser.
+        builds : build name to its vcs options data.
+        jobList : jobs to simulate, a job without "build" uses the first build.
+        outputDir : output directory.
+        listeners : called with the result of every simulation as it finishes.
+        db : results database used to schedule the longest jobs first.
+
+    Returns:
+        results : result of every simulation, empty if nothing simulated.
+    """
+    if args.co is False and len(jobList) == 0:
+        return []
+    if not builds:
+        logging.error("Didn't find a vcs entry in config.")
+        raise Exception("<YAML Error> Didn't find vcsOpts in YAML.")
+    for job in jobList:
+        job.setdefault("build", next(iter(builds)))
+        if job["build"] not in builds:
+            logging.error("Test %s needs build %s, which isn't in config." % (job["test"], job["build"]))
+            raise Exception("<YAML Error> Didn't find build %s in YAML." % job["build"])
+    for name, vcsOpts in builds.items():
+        if len(builds) == 1:
+            vcsOpts["cmp_dir"], vcsOpts["cov_dir"] = outputDir+"/compile", outputDir+"/cov.vdb"
+        else:
+            vcsOpts["cmp_dir"] = outputDir+"/compile_"+name
+            vcsOpts["cov_dir"] = vcsOpts["cmp_dir"]+"/cov.vdb"
+        vcsOpts["simv"] = vcsOpts["cmp_dir"]+"/vcs.simv"
+    needed = [name for name in builds if not jobList or any(job["build"] == name for job in jobList)]
+    stages = []
+
+    def prepare(name):
+        if not args.so:
+            compileBuild(args, name, builds[name], outputDir, len(needed) == 1)
+        if not args.co and args.stage is not None and not stopEvent.is_set():
+            stage = simvStage(args.stage, builds[name]["cmp_dir"])
+            try:
+                builds[name]["simv"] = stage.acquire()
+            except Exception as exc:
+                # Like a full /tmp, the compile itself is fine
+                stage.release()
+                logging.warning("Staging the simv of %s failed, simulating from %s: %s" %
+                                (name, builds[name]["simv"], exc))
+            else:
+                stages.append(stage)
+
+    results = []
+    interrupted = False
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(needed))
+    compiles = {executor.submit(prepare, name): name for name in needed}
+    try:
+        if args.co:
+            failed = None
+            for future in concurrent.futures.as_completed(compiles):
+                try:
+                    future.result()
+                except Exception as exc:
+                    logging.error("Compile of %s failed: %s" % (compiles[future], exc))
+                    failed = failed or exc
+            if failed is not None:
+                raise failed
+        else:
+            simulate(args, builds, jobList, outputDir, results, listeners, db, compiles)
+    except KeyboardInterrupt:
+        interrupted = True
+        stopEvent.set()
+        killActive()
+        raise
+    finally:
+        # The compiles killed by Ctrl-C aren't waited for, they stop at their next step
+        executor.shutdown(wait=not interrupted, cancel_futures=True)
+        for stage in stages:
+            stage.release()
+    return results
+
+
+def simulate(args, builds, jobList, outputDir, results, listeners=(), db=None, compiles=None):
+    """
+    Schedule and run the simulations, merge their coverage and rerun the
+    failed ones with waves.
+
+    Args:
+        args : command line parser.
+        builds : build name to its vcs options data, with the "simv" to run.
+        jobList : jobs to simulate.
+        outputDir : output directory.
+        results : result of every simulation.
+        listeners : called with the result of every simulation as it finishes.
+        db : results database used to schedule the longest jobs first.
+        compiles : compile future to the name of its build, the jobs of a
+                   build wait for its compile.
+
+    Returns:
+        Nothing
+    """
+    scheduleJobs(args, jobList, db)
+    jobTimeouts(args, builds, jobList, db)
+    merger = None
+    if args.covmerge:
+        createOutput(outputDir+"/cov_merge", True)
+        merger = covMerger(args.covcmd, outputDir+"/cov_merge", outputDir+"/cov_merged.vdb",
+                           args.covjobs, covMergeFanIn,
+                           [vdb for vdb in [vcsOpts["cov_dir"] for vcsOpts in builds.values()] if os.path.isdir(vdb)],
+                           args.covtime)
+        listeners = list(listeners) + [merger.add]
+    admission = admissionCtrl({"licenses": args.lic, "mem": args.mem or hostMemory(),
+                               "cpus": args.cpus}, args.watch)
+    if args.sock is not None:
+        try:
+            daemonRequest(args.sock, {"op": "status"})
+            admission = remoteAdmission(args.sock, admission)
+            logging.info("Simulations are admitted by the vrun daemon %s." % args.sock)
+        except OSError as exc:
+            logging.warning("vrun daemon %s not reachable, admitting simulations here: %s" % (args.sock, exc))
+    budget = failBudget(args.maxfails, args.testfails, args.sigstop)
+    try:
+        with tracer.span("simulations", jobs=len(jobList)):
+            runJobs(args, builds, jobList, outputDir, results, listeners, admission, budget, compiles)
+    except KeyboardInterrupt:
+        if merger is not None:
+            merger.cancel()
+        raise
+    if merger is not None:
+        with tracer.span("final coverage merge"):
+            merger.finish()
+    rerunList = []
+    if args.wof:
+        waveJobs(args, jobList, results, rerunList)
+    if rerunList:
+        logging.info("------ Rerunning %d failed jobs with %s waves ------" % (len(rerunList), args.wof))
+        with tracer.span("wave reruns", jobs=len(rerunList)):
+            runJobs(args, builds, rerunList, outputDir, [], (), admission)
+
+
+def expandJobs(matchedList, jobList, seeds):
+    """
+    Expand the matched tests into one job per iteration.
+
+    The first iteration keeps the test seed, the others draw theirs from
+    the seed stream. Every job gets the "name" of its directory,
+    <test>_<seed>, with its index added when another job has that name.
+
+    Args:
+        matchedList : test to run.
+        jobList : jobs extracted from the matched tests.
+        seeds : seed stream of the regression.
+
+    Returns:
+        Nothing
+    """
+    names = set()
+    for test in matchedList:
+        for i in range(test["iterations"]):
+            job = dict(test)
+            if i != 0:
+                job["seed"] = seeds.get(test["test"])
+            job["index"] = len(jobList)
+            job["name"] = "%s_%s" % (job["test"], job["seed"])
+            # Like a test listed twice with the seed of its YAML entry or -seed
+            while job["name"] in names:
+                job["name"] += "_%d" % job["index"]
+            names.add(job["name"])
+            jobList.append(job)
+
+
+def failureSignature(result):
+    """
+    Normalize the first error of a failed job into a signature.
+
+    Paths are cut to their base name, times, hex values, the seed and other
+    numbers are replaced, so the same failure of other seeds gives the same
+    signature.
+
+    Args:
+        result : result of a failed job, the first error line is read from
+                 its sim.log if the result doesn't have it.
+
+    Returns:
+        signature : normalized first error line.
+    """
+    line = result.get("firstError")
+    if line is None and result["dir"] is not None and os.path.isfile(result["dir"]+"/sim.log"):
+        with open(result["dir"]+"/sim.log", "r", errors="replace") as f:
+            for logLine in f:
+                if logAnalyzer.errorRe.search(logLine) and not logAnalyzer.summaryRe.match(logLine):
+                    line = logLine.strip()
+                    break
+    if line is None and result["status"] in ("TIMEOUT", "HANG"):
+        return "<%s>" % result["status"]
+    if line is None:
+        return "<no UVM_ERROR/UVM_FATAL, rc=%s>" % result.get("rc")
+    line = signaturePathRe.sub(lambda m: os.path.basename(m.group(0)), line)
+    line = signatureTimeRe.sub("<t>", line)
+    line = signatureHexRe.sub("<hex>", line)
+    line = re.sub(r"\b%d\b" % result["seed"], "<seed>", line)
+    line = signatureNumRe.sub("<n>", line)
+    return " ".join(line.split())
+
+
+def triageFailures(results, buckets):
+    """
+    Group the failed jobs by the signature of their first error.
+
+    Args:
+        results : result of every job.
+        buckets : signature to its failures count, tests and the failed
+                  job with the shortest simulation as reproducer.
+
+    Returns:
+        Nothing
+    """
+    for result in results:
+        if result["status"] in ("PASS", "SKIP"):
+            continue
+        signature = failureSignature(result)
+        bucket = buckets.setdefault(signature, {"count": 0, "tests": collections.Counter(), "repro": result})
+        bucket["count"] += 1
+        bucket["tests"][result["test"]] += 1
+        repro = bucket["repro"]
+        if (result.get("wall") or float("inf"), result["seed"]) < (repro.get("wall") or float("inf"), repro["seed"]):
+            bucket["repro"] = result
+
+
+def scheduleJobs(args, jobList, db, excludeRuns=None):
+    """
+    Order the jobs longest first by their historical simulation time.
+
+    Tests without history are estimated at the median of the known tests.
+    With --fail_first the tests whose latest run failed go first.
+
+    Args:
+        args : command line parser.
+        jobList : jobs to order, every job gets an "estimate" in seconds.
+        db : results database with the run history, None for no history.
+        excludeRuns : run id pattern of the runs not used as history.
+
+    Returns:
+        Nothing
+    """
+    durations = db.durations(excludeRuns=excludeRuns) if db is not None else {}
+    failing = db.failingTests() if db is not None and args.ff else set()
+    fallback = statistics.median(durations.values()) if durations else defaultEstimate
+    for job in jobList:
+        job["estimate"] = durations.get(job["test"], fallback)
+    jobList.sort(key=lambda job: (job["test"] not in failing, -job["estimate"], job["index"]))
+    logging.info("Scheduled %d jobs, %d tests without history estimated at %.1fs." %
+                 (len(jobList), len({job["test"] for job in jobList if job["test"] not in durations}), fallback))
+
+
+def jobTimeouts(args, builds, jobList, db):
+    """
+    Set the timeout and the inactivity limit of every job.
+
+    The timeout is -time if set, else the "timeout" of the test, else the
+    95th percentile of its history times -tfactor, else the "sim_timeout"
+    of the vcs entry of its build, else defaultTimeout. The inactivity limit
+    is -idle, else the "idle_timeout" of the test or of the vcs entry.
+
+    Args:
+        args : command line parser.
+        builds : build name to its vcs options data.
+        jobList : jobs, every job gets a "timeout" and an "idle_timeout".
+        db : results database with the run history.
+
+    Returns:
+        Nothing
+    """
+    history = db.percentiles() if args.tfactor is not None and db is not None else {}
+    sources = collections.Counter()
+    for job in jobList:
+        vcsOpts = builds[job["build"]]
+        if args.time is not None:
+            job["timeout"], source = args.time, "-time"
+        elif job.get("timeout") is not None:
+            source = "YAML"
+        elif job["test"] in history:
+            job["timeout"], source = max(history[job["test"]] * args.tfactor, minHistoryTimeout), "history"
+        elif vcsOpts.get("sim_timeout") is not None:
+            job["timeout"], source = vcsOpts["sim_timeout"], "sim_timeout"
+        else:
+            job["timeout"], source = defaultTimeout, "default"
+        sources[source] += 1
+        if args.idle is not None:
+            job["idle_timeout"] = args.idle
+        elif job.get("idle_timeout") is None:
+            job["idle_timeout"] = vcsOpts.get("idle_timeout")
+    logging.info("Job timeouts from %s." % ", ".join("%s %d" % item for item in sorted(sources.items())))
 
 
-def runCmd(cmd, tmoutSecond=600, exitOnError=True):
+def shardJobs(jobList, shards):
     """
-    Run command with timeout limit and return output.
+    Split the scheduled jobs into shards of about the same simulation time.
+
+    The jobs are given longest first to the least loaded shard.
 
     Args:
-        cmd : command to run.
-        tmoutSecond : timeout in second.
-        exitOnError : whether exit the script when command errors.
+        jobList : scheduled jobs with their estimate, every job gets its "shard".
+        shards : number of shards.
 
-    Return :
-        output : command output.
+    Returns:
+        plan : digest of the whole split.
+        loads : predicted simulation time of every shard.
+    """
+    loads = [(0.0, i) for i in range(shards)]
+    split = []
+    for job in sorted(jobList, key=lambda job: (-job["estimate"], job["index"])):
+        load, i = heapq.heappop(loads)
+        heapq.heappush(loads, (load + job["estimate"], i))
+        job["shard"] = i + 1
+        split.append((job["index"], job["test"], job["seed"], job["sim_opts"].strip(), i + 1))
+    plan = hashlib.sha1(json.dumps(sorted(split)).encode()).hexdigest()
+    return plan, [load for load, i in sorted(loads, key=lambda item: item[1])]
+
+
+def readShardPlan(args):
+    """
+    Read the shard plan of the regression and check it matches this shard.
+
+    Args:
+        args : command line parser, with -shard, -shardplan and -regr.
+
+    Returns:
+        plan : the split written by writeShardPlan, None if there is none yet.
     """
-    logging.info(cmd)
-    try:
-        ps = subprocess.Popen(
-            "exec " + cmd,
-            shell=True,
-            executable='/bin/bash',
-            universal_newlines=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT
-        )
-    except subprocess.CalledProcessError:
-        logging.error(ps.commuicate()[0])
-        raise Exception("<Command Error> Subprocess running failed.")
-    except KeyboardInterrupt:
-        logging.debug("\nExited Ctrl-C from user request.")
-        raise KeyboardInterrupt("<Keyboard Error> Exited Ctrl+C from user request.")
     try:
-        output = ps.communicate(timeout=tmoutSecond)[0]
-    except subprocess.TimeoutExpired:
-        logging.error("Timeout[%ds]: %s"%(tmoutSecond, cmd))
-        output = ""
-        ps.kill()
-        raise Exception("<Command Error> Subprocess timeout.")
-    rc = ps.returncode
-    if rc and rc > 0:
-        logging.debug(output)
-        logging.error("Error return code: %s"%rc)
-        if exitOnError:
-            raise Exception("<Command Error> Subprocess running failed with return code: %s."%rc)
-    logging.debug(output)
-    return output
+        with open(args.shardplan, "r") as f:
+            plan = json.load(f)
+    except FileNotFoundError:
+        return None
+    with open(args.regr, "rb") as f:
+        regrDigest = hashlib.sha1(f.read()).hexdigest()
+    if plan["shards"] != args.shard[1]:
+        logging.error("Shard plan %s has %d shards, not %d." % (args.shardplan, plan["shards"], args.shard[1]))
+        raise Exception("<Config Error> -shard doesn't match the shard plan.")
+    if plan["regr_digest"] != regrDigest:
+        logging.error("Shard plan %s was made from another regression list than %s." % (args.shardplan, args.regr))
+        raise Exception("<Config Error> -regr doesn't match the shard plan.")
+    if args.rseed is not None and args.rseed != plan["rseed"]:
+        logging.error("Shard plan %s was made with regression seed %d." % (args.shardplan, plan["rseed"]))
+        raise Exception("<Config Error> -rseed doesn't match the shard plan.")
+    return plan
 
 
-def readYaml(yamlFile):
+def writeShardPlan(args, jobList, plan, loads):
     """
-    Read YAML file to a dictionary
+    Write the shard plan of the regression unless another shard wrote one first.
+
+    The plan is written to a temporary file and hard linked to its name,
+    which fails if the name exists, so only one plan is ever written.
 
     Args:
-        yamlFile : YAML file
+        args : command line parser, with -shard, -shardplan, -regr and -rseed.
+        jobList : jobs of the regression with their "shard".
+        plan : digest of the split.
+        loads : predicted simulation time of every shard.
 
     Returns:
-        yamlData : data read from YAML in dictionary format
+        True if this plan was written, False if another shard wrote its plan first.
     """
-    with open(yamlFile, "r") as f:
-            try:
-                    yamlData = yaml.safe_load(f)
-            except yaml.YAMLError as exc:
-                    logging.error(exc)
-                    raise Exception("<YAML Error> YAML data error.")
-    return yamlData
+    with open(args.regr, "rb") as f:
+        regrDigest = hashlib.sha1(f.read()).hexdigest()
+    data = {"plan": plan, "shards": args.shard[1], "loads": loads, "rseed": args.rseed,
+            "regr": os.path.abspath(args.regr), "regr_digest": regrDigest, "cfg": os.path.abspath(args.cfg),
+            "created": time.time(), "jobs": jobList}
+    tmpPath = "%s.%d.tmp" % (args.shardplan, os.getpid())
+    with open(tmpPath, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    try:
+        os.link(tmpPath, args.shardplan)
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(tmpPath)
+    return True
 
 
-def createOutput(output, clean, prefix="out_"):
+def mergeShards(paths, results):
     """
-    Create output directory
+    Combine the run manifests of the shards of a regression.
 
     Args:
-        output : Name of specified output directory
-        noclean: Do not clean the output of the previous runs
+        paths : run manifest of every shard.
+        results : latest result of every job of every shard.
 
     Returns:
-        Output directory
+        Nothing
     """
-    # Create output directory
-    if output is None:
-        output = prefix + str(datetime.date.today())
-    if clean is True:
-        os.system("rm -r {}".format(output))
+    plans = set()
+    shards = {}
+    for path in paths:
+        manifest = runManifest(path)
+        manifest.load()
+        if "shard" not in manifest.info:
+            logging.error("%s isn't the manifest of a shard." % path)
+            raise Exception("<Config Error> Merge needs the run manifests of -shard runs.")
+        plans.add((manifest.info["plan"], manifest.info["shards"]))
+        shards[manifest.info["shard"]] = path
+        manifest.results(results)
+        logging.info("Shard %d/%d %s: %s" % (manifest.info["shard"], manifest.info["shards"], path,
+                                            ", ".join("%d %s" % (cnt, status) for status, cnt in sorted(manifest.counts().items()))))
+    if len(plans) != 1:
+        logging.error("The shards were split from different regressions: %s" % sorted(plans))
+        raise Exception("<Config Error> Merge needs shards of the same regression.")
+    shardCnt = plans.pop()[1]
+    missing = [i for i in range(1, shardCnt + 1) if i not in shards]
+    if missing:
+        logging.error("Missing shards: %s" % ", ".join(str(i) for i in missing))
+    for result in results:
+        if result["status"] == "PENDING":
+            result["status"] = "NOT_RUN"
+    results.sort(key=lambda result: result["index"])
 
-    logging.info("Creating output directory: %s" % output)
-    subprocess.run(["mkdir", "-p", output])
-    return output
 
+def planMakespan(jobList, maxJobs):
+    """
+    Predict the wall time of running the ordered jobs on maxJobs workers.
+
+    Args:
+        jobList : scheduled jobs with their estimate.
+        maxJobs : number of parallel jobs.
 
-def loadConfig(args, cfg, vcsOpts, testList):
+    Returns:
+        makespan : predicted time until the last job ends.
     """
-    Extract script config from YAML.
+    workers = [0.0] * maxJobs
+    for job in jobList:
+        heapq.heapreplace(workers, workers[0] + job["estimate"])
+    return max(workers)
 
-    Args :
+
+def runJobs(args, builds, jobList, outputDir, results, listeners=(), admission=None, budget=None, compiles=None):
+    """
+    Run the simulation jobs, at most args.jobs of them at the same time.
+
+    Every job is simulated in a worker thread, the results are collected
+    by the calling thread only. The jobs of a build still compiling are
+    held back while the jobs of the ready builds run, in their scheduled
+    order. The jobs of a build whose compile failed get the CMP_FAIL
+    status, and a job whose simulation raised an error fails alone.
+    Ctrl-C or an error of the run itself cancels the jobs not started yet
+    and kills the running simulations.
+
+    Args:
         args : command line parser.
-        vcsOpts : vcs options data.
-        testList : test list extracted from YAML.
+        builds : build name to its vcs options data.
+        jobList : jobs to run.
+        outputDir : output directory.
+        results : result of every finished job.
+        listeners : called with the result of every job as it finishes.
+        admission : admission control of the simulations, None for no limit.
+        budget : stopping policies skipping the jobs not started yet, None to run all.
+        compiles : compile future to the name of its build, None if every build is ready.
 
-    Returns :
+    Returns:
         Nothing
     """
-    yamlData = readYaml(cfg)
-    global vcsOptCnt
-    for entry in yamlData:
-        if "import" in entry:
-            loadConfig(args, os.path.expandvars(entry['import']), vcsOpts, testList)
-        elif "vcs" in entry:
-            vcsOpts.update(entry)
-            vcsOptCnt += 1
-            if vcsOptCnt > 1:
-                logging.error("Found more than 1 vcsOpts entry in config.")
-                raise Exception("<YAML Error> More than 1 vcsOpts in YAML.")
-            if "flist" not in entry:
-                logging.error("Didn't find flist in vcsOpts.")
-                raise Exception("<YAML Error> Didn't find flist in YAML.")
-            # Compile options
-            cmpOpts = ""
-            if args.copt is not None:
-                cmpOpts += " " + args.copt
-            elif "cmp_opts" in entry:
-                cmpOpts += " " + entry["cmp_opts"]
-            vcsOpts["cmp_opts"] = cmpOpts
-            # Elaboration options
-            elabOpts = ""
-            if args.eopt is not None:
-                elabOpts += " " + args.eopt
-            elif "elab_opts" in entry:
-                elabOpts += " " + entry["elab_opts"]
-            vcsOpts["elab_opts"] = elabOpts
-        elif "test" in entry:
-            testList.append(entry)
+    maxJobs = args.jobs
+    if args.dstep or args.vstep:
+        maxJobs = 1
+    logging.info("Running %d simulations with %d jobs." % (len(jobList), maxJobs))
+    order = {job["index"]: i for i, job in enumerate(jobList)}
+    pending = collections.OrderedDict()
+    for job in jobList:
+        pending.setdefault(job["build"], collections.deque()).append(job)
+    compiling = dict(compiles or {})
+    failedBuilds = set()
+    running = {}
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=maxJobs)
 
+    def nextJob():
+        ready = [queue for name, queue in pending.items() if queue and name not in compiling.values()]
+        if not ready:
+            return None
+        return min(ready, key=lambda queue: order[queue[0]["index"]]).popleft()
 
-def getEnvVar(var):
+    def collect(result):
+        results.append(result)
+        if budget is not None:
+            budget.record(result)
+        for listener in listeners:
+            listener(result)
+
+    try:
+        while any(pending.values()) or running or compiling:
+            while len(running) < maxJobs:
+                job = nextJob()
+                if job is None:
+                    break
+                if job["build"] in failedBuilds:
+                    collect({"index": job["index"], "test": job["test"], "uvm_test": job.get("uvm_test"),
+                             "seed": job["seed"], "sim_opts": job["sim_opts"].strip(), "dir": None,
+                             "status": "CMP_FAIL", "queue_wait": 0.0,
+                             "firstError": "Compile of build %s failed" % job["build"]})
+                    continue
+                reason = budget.check(job) if budget is not None else None
+                if reason is not None:
+                    collect({"index": job["index"], "test": job["test"], "uvm_test": job.get("uvm_test"),
+                             "seed": job["seed"], "sim_opts": job["sim_opts"].strip(), "dir": None,
+                             "status": "SKIP", "queue_wait": 0.0, "skipReason": reason})
+                    continue
+                running[executor.submit(runSim, args, builds[job["build"]], job, outputDir, admission)] = job
+            if not running and not compiling:
+                continue
+            done, _ = concurrent.futures.wait(set(running) | set(compiling),
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future in compiling:
+                    name = compiling.pop(future)
+                    try:
+                        future.result()
+                        logging.info("Build %s is ready, starting its %d simulations." % (name, len(pending.get(name, ()))))
+                    except Exception as exc:
+                        logging.error("Compile of %s failed: %s" % (name, exc))
+                        failedBuilds.add(name)
+                    continue
+                job = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    # Only this job fails, the regression goes on
+                    logging.error("%s_%s: %s" % (job["test"], job["seed"], exc))
+                    result = {"index": job["index"], "test": job["test"], "uvm_test": job.get("uvm_test"),
+                              "seed": job["seed"], "sim_opts": job["sim_opts"].strip(), "dir": None,
+                              "status": "FAIL", "queue_wait": 0.0, "firstError": "vrun error: %s" % exc}
+                collect(result)
+    except BaseException:
+        # Ctrl-C or an error of vrun itself
+        stopEvent.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        killActive()
+        raise
+    executor.shutdown()
+    results.sort(key=lambda result: result["index"])
+
+
+def runSim(args, vcsOpts, job, outputDir, admission=None):
     """
-    Get the value of environment variable
+    Simulate one job in its own output directory and classify its log.
 
     Args:
-        var : Name of the environment variable
+        args : command line parser.
+        vcsOpts : vcs options data of the build of the job.
+        job : test with its seed to simulate in the directory of its "name",
+              its "waves" and "dir" override the wave options and the
+              simulation directory.
+        outputDir : output directory.
+        admission : admission control the simulation waits in, if set.
 
     Returns:
-        val : Value of the environment variable
+        result : job status and output directory.
     """
+    name = job.get("name") or "%s_%s" % (job["test"], job["seed"])
+    simOutput = createOutput(job.get("dir") or outputDir+"/"+name, True)
+    result = {"index": job["index"], "test": job["test"], "uvm_test": job.get("uvm_test"),
+              "seed": job["seed"], "sim_opts": job["sim_opts"].strip(), "dir": simOutput,
+              "status": "FAIL", "queue_wait": 0.0}
+    simTestCmd = "%s +UVM_VERBOSITY=%s" % (vcsOpts["simv"], args.v)
+    if "uvm_test" in job:
+        simTestCmd += " +UVM_TESTNAME=%s" % job["uvm_test"]
+    else:
+        simTestCmd += " +UVM_TESTNAME=%s" % job["test"]
+    simTestCmd += " -ntb_random_seed=%d -l %s/sim.log" % (job["seed"], simOutput)
+    waves = job.get("waves") or {"vpd": args.vpd, "fsdb": args.fsdb, "scope": args.wscope, "start": None}
+    if waves["vpd"] or waves["fsdb"]:
+        simTestCmd += " -ucli -do %s/sim.tcl" % simOutput
+        if waves["vpd"]:
+            simTestCmd += " -vpd_file %s/sim.vpd" % simOutput
+        if waves["fsdb"]:
+            simTestCmd += " +fsdb+autoflush +fsdb+all +fsdb+mda"
+    if job["sim_opts"] != "":
+        simTestCmd += job["sim_opts"].strip("\n")
+    writeSimTcl(simOutput+"/sim.tcl", waves, vcsOpts["top"].strip("\n"), args.dstep or args.vstep)
+    if vcsOpts["cov"]:
+        simTestCmd += " -cm line+tgl+fsm+cond+branch+assert -cm_cond allops"
+        simTestCmd += " -cm_name %s" % name
+        if args.covmerge:
+            simTestCmd += " -cm_dir %s/cov.vdb" % simOutput
+    with open(simOutput+"/sim.sh", "w") as f:
+        f.write(simTestCmd)
+    if admission is not None:
+        result["queue_wait"] = admission.acquire(job)
+        if result["queue_wait"] is None:
+            return result
+    logging.info("------ Starting sim: %s ------" % simOutput)
+    hasError = False
     try:
-        val = os.environ[var]
-    except KeyError:
-        logging.warning("Please set the environment variable {}".format(var))
-        raise KeyError("<Key Error> Didn't find environment value with key {}.".format(var))
-    return val
+        with open(simOutput+"/error_message.log", "w") as em, open(simOutput+"/warning_message.log", "w") as wm:
+            analyzer = logAnalyzer(em, wm, args.maxerr)
+            try:
+                with tracer.span(os.path.basename(simOutput), "sim", False, queue_wait=result["queue_wait"]):
+                    runCmd(simTestCmd, job.get("timeout") or args.time or defaultTimeout, cwd=simOutput,
+                           onLine=analyzer.feed, tailLines=20, stats=result, idleSecond=job.get("idle_timeout"))
+            except Exception as exc:
+                logging.error("%s: %s" % (simOutput, exc))
+                hasError = True
+    finally:
+        if admission is not None:
+            admission.release(job)
+    if stopEvent.is_set():
+        return result
+    if analyzer.aborted:
+        logging.error("%s: killed after %d errors%s." % (simOutput, analyzer.errorCnt,
+                                                         " and UVM_FATAL" if analyzer.fatal else ""))
+    if analyzer.hasError or analyzer.aborted:
+        hasError = True
+    result["firstError"] = analyzer.firstError
+    if not hasError:
+        result["status"] = "PASS"
+    elif result.get("killReason") is not None:
+        result["status"] = result["killReason"]
+        if result["status"] == "SIGNAL" and result["firstError"] is None:
+            result["firstError"] = "Killed by %s" % signalName(-result["rc"])
+    with open(simOutput+"/"+result["status"], "w") as fv:
+        fv.write(result["status"])
+    if result["status"] == "PASS" and args.passlogs != "keep":
+        retainLog(simOutput+"/sim.log", args.passlogs)
+    logging.info("------ Finished: %s %s ------" % (result["status"], simOutput))
+    return result
 
 
-def loadRegrList(regr, regrList):
+def writeSimTcl(path, waves, top, step):
     """
-    Extract regression list from file.
+    Write the ucli script of a simulation.
 
     Args:
-        regr : regression list path.
-        regrList : test list extracted from regression list.
+        path : sim.tcl path.
+        waves : wave flags of the job, vpd, fsdb, the dump scope and the
+                time in ns the dump starts at, None for the whole run.
+        top : top module, dumped when the job has no scope.
+        step : leave the simulation stopped for DVE/Verdi step mode.
 
-    Returns :
+    Returns:
         Nothing
     """
-    yamlData = readYaml(regr)
-    for entry in yamlData:
-        if "test" in entry:
-            regrList.append(entry)
+    with open(path, "w") as f:
+        if waves.get("start"):
+            f.write("run %d ns\n" % waves["start"])
+        if waves["vpd"]:
+            if waves.get("scope"):
+                f.write("dump -add %s -depth 0\n" % waves["scope"])
+            else:
+                f.write("dump -add /*\n")
+        if waves["fsdb"]:
+            f.write("fsdbDumpfile \"sim.fsdb\"\n")
+            f.write("fsdbDumpvars 0 %s\n" % (waves.get("scope") or top))
+        if not step:
+            f.write("run")
+
+
+def errorTime(line):
+    """
+    Get the simulation time of an error line.
+
+    UVM prints times in the precision of the timescale by default, so a
+    time without a unit is read in the precision vrun compiles with.
+
+    Args:
+        line : UVM_ERROR/UVM_FATAL line, like "UVM_ERROR a.sv(3) @ 1200ns: ...".
+
+    Returns:
+        time : time in ns, None if the line has no time.
+    """
+    match = errorTimeRe.search(line or "")
+    if match is None:
+        return None
+    if match.group(2) is not None:
+        return float(match.group(1)) * timeUnits[match.group(2)]
+    precision = re.match(r"^(\d+)\s*([fpnum]?s)$", timescale.split("/")[1])
+    return float(match.group(1)) * int(precision.group(1)) * timeUnits[precision.group(2)]
 
 
-def processVCS(args, vcsOpts, matchedList, outputDir):
+def waveJobs(args, jobList, results, rerunList):
     """
-    Run the simulator.
+    Plan the reruns with waves of the failed jobs.
+
+    Every rerun dumps into the waves directory of its failed job, from
+    args.wpre ns before the first error if it is set.
 
     Args:
         args : command line parser.
-        vcsOpts : vcs options data.
-        matchedList : test to run.
-        outputDir : output directory.
+        jobList : jobs of the regression.
+        results : result of every job, failed ones get their "waves" directory.
+        rerunList : reruns of the failed jobs.
 
     Returns:
         Nothing
     """
-    global isSimed
-    global errorCnt
-    global errorList
-    if args.co is False and len(matchedList) == 0:
+    jobs = {job["index"]: job for job in jobList}
+    for result in results:
+        if result["status"] not in failStatuses or result["dir"] is None or result["index"] not in jobs:
+            continue
+        start = None
+        if args.wpre is not None and errorTime(result.get("firstError")) is not None:
+            start = max(errorTime(result.get("firstError")) - args.wpre, 0)
+        job = dict(jobs[result["index"]], dir=result["dir"]+"/waves")
+        job["waves"] = {"vpd": args.wof == "vpd", "fsdb": args.wof == "fsdb", "scope": args.wscope, "start": start}
+        result["waves"] = job["dir"]
+        rerunList.append(job)
+
+
+def retainLog(log, policy, keepLines=1000):
+    """
+    Shrink the log of a passing simulation.
+
+    Args:
+        log : log path.
+        policy : gzip or zstd to compress the log, truncate to keep its
+                 last keepLines lines.
+        keepLines : lines kept by truncate.
+
+    Returns:
+        Nothing
+    """
+    if not os.path.isfile(log):
         return
-    vloganCmd = ("vlogan -full64 -sverilog -lca -ntb_opts uvm-1.2 -timescale=1ns/1ps -kdb "
-                                "-l %s/compile/vlogan.log" % outputDir)
-    vcsCmd = ("vcs -full64 -sverilog -lca -ntb_opts uvm-1.2 -partcomp -kdb "
-                         "-CFLAGS '--std=c99 -fno-extended-identifiers' "
-                         "-LDFLAGS '-Wl,--no-as-needed' -debug_acc+all "
-                         "-l %s/compile/vcs.log -o %s/compile/vcs.simv" % (outputDir, outputDir))
-    simCmd = "%s/compile/vcs.simv +UVM_VERBOSITY=%s" % (outputDir, args.v)
-
-    if not args.so:
-        cmp_output = createOutput(outputDir+"/compile", args.clean)
-        os.chdir(cmp_output)
-        logging.info("------ Starting vlogan UVM ------")
-        runCmd(vloganCmd, args.time)
-        vloganCmd = vloganCmd + " " + vcsOpts["flist"].strip("\n")
-        logging.info("------ Starting vlogan ------")
-        with open("vlogan.sh", "w") as f:
-            f.write(vloganCmd)
-        runCmd(vloganCmd, args.time)
-        logging.info("------ Finished ------")
-        vcsCmd = vcsCmd + " -top %s" % vcsOpts["top"].strip("\n")
-        if args.cov:
-            vcsCmd += " -cm line+tgl+fsm+cond+branch+assert -cm_cond allops -cm_dir %s/cov.vdb" % outputDir
-        logging.info("------ Starting vcs ------")
-        with open("vcs.sh", "w") as f:
-            f.write(vcsCmd)
-        runCmd(vcsCmd, args.time)
-        logging.info("------ Finished ------")
-    if not args.co:
-        for test in matchedList:
-            isSimed = True
-            for i in range(test["iterations"]):
-                if i != 0:
-                    test["seed"] = random.getrandbits(31)
-                simOutput = createOutput(outputDir+"/"+test["test"]+"_%s"%test["seed"], True)
-                os.chdir(simOutput)
-                if "uvm_test" in test:
-                    simTestCmd = simCmd + " +UVM_TESTNAME=%s" % test["uvm_test"]
-                else:
-                    simTestCmd = simCmd + " +UVM_TESTNAME=%s" % test["test"]
-                simTestCmd += " -ntb_random_seed=%d -l %s/sim.log" % (test["seed"], simOutput)
-                if args.vpd or args.fsdb:
-                    simTestCmd += " -ucli -do %s/sim.tcl" % simOutput
-                    if args.vpd:
-                        simTestCmd += " -vpd_file %s/sim.vpd" % simOutput
-                    if args.fsdb:
-                        simTestCmd += " +fsdb+autoflush +fsdb+all +fsdb+mda"
-                if test["sim_opts"] != "":
-                    simTestCmd += test["sim_opts"].strip("\n")
-                with open("sim.tcl", "w") as f:
-                    if args.vpd:
-                        f.write("dump -add /*\n")
-                    if args.fsdb:
-                        f.write("fsdbDumpfile \"sim.fsdb\"\n")
-                        f.write("fsdbDumpvars 0 %s\n" % vcsOpts["top"].strip("\n"))
-                    if not(args.dstep or args.vstep):
-                        f.write("run")
-                if args.cov:
-                    simTestCmd += " -cm line+tgl+fsm+cond+branch+assert -cm_cond allops"
-                    simTestCmd += " -cm_name %s_%s" % (test["test"], test["seed"])
-                logging.info("------ Starting sim ------")
-                with open("sim.sh", "w") as f:
-                    f.write(simTestCmd)
-                runCmd(simTestCmd, args.time)
-                with open("sim.log", "r") as f:
-                    em = open("error_message.log", "w")
-                    wm = open("warning_message.log", "w")
-                    for line in f.readlines():
-                        if line.startswith("UVM_ERROR") or line.startswith("UVM_FATAL") or "Error" in line:
-                            if line != "UVM_ERROR :    0\n" and line != "UVM_FATAL :    0\n":
-                                em.write(line)
-                        elif line.startswith("UVM_WARNING"):
-                            if line != "UVM_WARNING :    0\n":
-                                wm.write(line)
-                    em.close()
-                    wm.close()
-                    if os.path.getsize("error_message.log") == 0:
-                        with open("PASS", "w") as fp:
-                            fp.write("PASS")
-                    else:
-                        with open("FAIL", "w") as ff:
-                            ff.write("FAIL")
-                        errorCnt += 1
-                        errorList.append(simOutput)
-                logging.info("------ Finished ------")
-
-
-def organizeTest(testname, testList, matchTest):
-    """
-    origin test because of extends.
-
-    Args:
-        entry : leaf test.
-        testList : all test.
-    """
-    testHit = False
-    for entry in testList:
-        if testname == entry["test"]:
-            testHit = True
-            if "sim_opts" not in entry:
-                entry["sim_opts"] = ""
-            if "extends" in entry:
-                fatherTest = {}
-                organizeTest(entry["extends"], testList, fatherTest)
-                father = fatherTest
-                father["sim_opts"] = father["sim_opts"].strip("\n")
-                entry["sim_opts"] = entry["sim_opts"].strip("\n")
-                father["sim_opts"] = father["sim_opts"].strip()
-                entry["sim_opts"] = entry["sim_opts"].strip()
-                f_dict = {}
-                e_dict = {}
-                for f_opt in re.split(r"[ ]+", father["sim_opts"]):
-                    f_dict[f_opt.split("=")[0]] = f_opt.split("=")[1]
-                for e_opt in re.split(r"[ ]+", entry["sim_opts"]):
-                    e_dict[e_opt.split("=")[0]] = e_opt.split("=")[1]
-                for param in father:
-                    if param == "test" or param == "extends":
-                        continue
-                    elif param == "sim_opts":
-                        for key in f_dict:
-                            if key not in e_dict:
-                                e_dict[key] = f_dict[key]
-                        entry["sim_opts"] = ""
-                        for key in e_dict:
-                            entry["sim_opts"] += key + "=" + e_dict[key] + " "
-                    else:
-                        if param not in entry:
-                            entry[param] = father[param]
-                matchTest.update(entry)
-            else:
-                matchTest.update(entry)
-    if not testHit:
-        logging.error("No testname: %s found in test list!" % testname)
-        raise Exception("Test not found.")
+    if policy == "truncate":
+        lineCnt = 0
+        tail = collections.deque(maxlen=keepLines)
+        with open(log, "r", errors="replace") as f:
+            for line in f:
+                lineCnt += 1
+                tail.append(line)
+        if lineCnt <= keepLines:
+            return
+        with open(log + ".tmp", "w") as f:
+            f.write("... %d lines truncated by vrun ...\n" % (lineCnt - keepLines))
+            f.writelines(tail)
+        os.replace(log + ".tmp", log)
+        return
+    cmd = ["gzip", "-f", log] if policy == "gzip" else ["zstd", "-q", "-f", "--rm", log]
+    try:
+        ps = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    except FileNotFoundError:
+        logging.warning("%s not found, keeping %s." % (cmd[0], log))
+        return
+    if ps.returncode != 0:
+        logging.warning("%s failed on %s: %s" % (cmd[0], log, ps.stderr.strip()))
+
+
+def mergeSimOpts(fatherOpts, simOpts):
+    """
+    Merge simulation options, an option is overridden by one with the same name.
+
+    Options are compared by the text before "=", options without "=" by
+    their whole text.
 
-def extractTest(args, testList, matchedList):
+    Args:
+        fatherOpts : options of the father test.
+        simOpts : options of the test itself.
+
+    Returns:
+        merged : test options followed by the father options not overridden.
+    """
+    merged = collections.OrderedDict()
+    for opt in simOpts.split():
+        merged[opt.split("=", 1)[0]] = opt
+    for opt in fatherOpts.split():
+        merged.setdefault(opt.split("=", 1)[0], opt)
+    return " ".join(merged.values())
+
+
+def extractTest(args, testList, matchedList, seeds):
     """
     extractTest for matched list.
 
@@ -429,18 +3249,19 @@ def extractTest(args, testList, matchedList):
         args : command line parser.
         testList : test list extracted from YAML.
         matchedList : test to run.
+        seeds : seed stream of the tests without a seed.
 
     Returns:
         Nothing
     """
+    resolver = testResolver(testList)
     if args.test is not None:
-        matchTest = {}
-        organizeTest(args.test, testList, matchTest)
+        matchTest = dict(resolver.resolve(args.test))
         # Seed
         if args.seed is not None:
             matchTest["seed"] = args.seed
         elif "seed" not in matchTest:
-            matchTest["seed"] = random.getrandbits(31)
+            matchTest["seed"] = seeds.get(matchTest["test"])
         # UVM Test
         # Iterations
         if args.iter > 1:
@@ -464,15 +3285,14 @@ def extractTest(args, testList, matchedList):
         regrList = []
         loadRegrList(args.regr, regrList)
         for regrEntry in regrList:
-            matchTest = {}
-            organizeTest(regrEntry["test"], testList, matchTest)
+            matchTest = dict(resolver.resolve(regrEntry["test"]))
             # Seed
             if args.seed is not None:
                 matchTest["seed"] = args.seed
             elif "seed" in regrEntry:
                 matchTest["seed"] = regrEntry["seed"]
             elif "seed" not in matchTest:
-                matchTest["seed"] = random.getrandbits(31)
+                matchTest["seed"] = seeds.get(matchTest["test"])
             # UVM Test
             # Iterations
             if args.iter > 1:
@@ -493,46 +3313,117 @@ def extractTest(args, testList, matchedList):
             matchedList.append(matchTest)
 
 
-# Global Status
-isSimed = False
-vcsOptCnt = 0
-errorCnt = 0
-errorList = []
-def main():
+def restoreCompileFlags(args, info):
     """
-    This is the main program.
+    Take the compile options of the run being resumed or rerun, so its
+    compile is reused when it is still up to date.
+
+    Args:
+        args : command line parser.
+        info : run information of the manifest.
+
+    Returns:
+        Nothing
     """
-    try:
-        vcsOpts = {}
-        testList = []
-        matchedList = []
+    flags = info.get("compile")
+    if flags is None:
+        logging.warning("The run was planned before its compile options were recorded, using these of the command line.")
+        return
+    for flag in compileFlags:
+        if getattr(args, flag) in (None, False):
+            setattr(args, flag, flags[flag])
+        elif getattr(args, flag) != flags[flag]:
+            logging.error("The run was planned with -%s %s, not %s." % (flag, flags[flag], getattr(args, flag)))
+            raise Exception("<Config Error> --resume and --rerun_failed keep the compile options of the run.")
+    if any(flags.values()):
+        logging.info("Compile options of the run: %s" %
+                     ", ".join("-%s %s" % (flag, flags[flag]) for flag in compileFlags if flags[flag]))
 
-        cwd = os.getcwd()
-        FORMAT = "%(asctime)-15s %(levelname)s: %(message)s"
-        logging.basicConfig(format=FORMAT,level=logging.INFO)
-        args = parseArgs(cwd)
-        logging.info("Starting to run VCS script in directory: %s" % cwd)
-        logging.info("Output directory is %s" % os.path.expandvars(args.o))
-        outputDir = createOutput(args.o, args.clean)
 
-        loadConfig(args, args.cfg, vcsOpts, testList)
-        if args.st:
-            testNum = 0
-            logging.info("The tests that can be executed are:")
-            for entry in testList:
-                logging.info("%d: %s"%(testNum, entry["test"]))
-                testNum += 1
+# Compile results kept by -clean, they are rebuilt only when the compile cache misses
+compileOutputs = ("compile", "compile_*", "cov.vdb")
+# $VAR and ${VAR} of config import paths
+envVarRe = re.compile(r"\$(\w+)|\$\{([^}]*)\}")
+# Name of the build of a vcs entry without "build"
+defaultBuild = "default"
+# File extensions hashed in +incdir+ and -y directories
+hdlExts = {".v", ".vh", ".sv", ".svh", ".svi", ".sva", ".inc", ".h", ".vhd", ".vhdl"}
+
+# Databases merged together by a partial coverage merge
+covMergeFanIn = 8
+
+# Failure signature normalization
+signaturePathRe = re.compile(r"(?:[\w.+-]*/)+[\w.+-]+")
+signatureTimeRe = re.compile(r"(?<=@ )\d+(?:\.\d+)?\s*(?:[fpnum]?s)?|\b\d+(?:\.\d+)?\s*[fpnum]s\b")
+signatureHexRe = re.compile(r"\b0x[0-9a-fA-F_]+\b|\b\d*'[sS]?[hH][0-9a-fA-FxXzZ_]+\b")
+signatureNumRe = re.compile(r"(?<!\()\b\d+\b(?!\))")
+
+# Time unit/precision of the compile, error times without a unit are in its precision
+timescale = "1ns/1ps"
+# Time of an error line and the units it can have
+errorTimeRe = re.compile(r"@\s*(\d+(?:\.\d+)?)\s*([fpnum]?s)?\b")
+timeUnits = {"fs": 1e-6, "ps": 1e-3, "ns": 1.0, "us": 1e3, "ms": 1e6, "s": 1e9}
+
+# Command timeout when neither -time, the YAML nor the history sets one
+defaultTimeout = 300
+# Shortest timeout derived from the history
+minHistoryTimeout = 60
+# Options changing the compile, kept by the run manifest for --resume and --rerun_failed
+compileFlags = ("cov", "copt", "eopt")
+# Statuses of the failed jobs, rerun by --rerun_failed
+failStatuses = ("FAIL", "TIMEOUT", "HANG", "SIGNAL", "CMP_FAIL")
+
+# Estimated simulation seconds of a test when no test has history
+defaultEstimate = 60.0
+# History kept by -clean
+historyOutputs = ("vrun.db",)
+# Checksums of a staged simv, written last so an image with it is complete
+stageChecksums = "vrun_checksums.json"
+# Unix socket of -daemon when -sock isn't set
+daemonSock = "/tmp/vrun.sock"
+# Old outputs are moved here and deleted in the background
+trashDir = ".vrun_trash"
+# Jobs and status of the latest run, for --resume and --rerun_failed
+manifestFile = "vrun_manifest.json"
+# Use the libyaml loader when PyYAML is built with it
+yamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+# Bumped when the flattened config format changes
+configCacheVersion = 1
+
+# Global Status
+tracer = spanTracer()
+activeProcs = set()
+procLock = threading.Lock()
+stopEvent = threading.Event()
+runTrash = trashBatch()
+def reportResults(results):
+    """
+    Report the results of a run: skipped jobs, queue waits, the failures
+    grouped by signature and the PASS/FAIL banner.
+
+    Args:
+        results : result of every job.
 
-        extractTest(args, testList, matchedList)
-        logging.info("Tests that is going to be processed are:")
-        for test in matchedList:
-            logging.info(test)
+    Returns:
+        Nothing
+    """
+    errorList = [result["dir"] for result in results if result["status"] not in ("PASS", "SKIP")]
+    skipped = [result for result in results if result["status"] == "SKIP"]
+    if skipped:
+        logging.warning("%d jobs skipped: %s" % (len(skipped), ", ".join(sorted(
+            "%s(%d)" % item for item in collections.Counter(result["test"] for result in skipped).items()))))
 
-        processVCS(args, vcsOpts, matchedList, outputDir)
+    waited = sorted([result for result in results if (result.get("queue_wait") or 0) >= 0.1],
+                    key=lambda result: -result["queue_wait"])
+    if waited:
+        logging.info("Queue wait: %d jobs waited %.1fs in total, longest waits:" %
+                     (len(waited), sum(result["queue_wait"] for result in waited)))
+        for result in waited[:10]:
+            logging.info("    %8.1fs  %s" % (result["queue_wait"], result["dir"]))
 
-        if isSimed:
-            if errorCnt == 0:
-                logging.info("\n" + "\033[0;32m" +
+    if results:
+        if len(errorList) == 0:
+            logging.info("\n" + "\033[0;32m" +
 "~~~~~~~~~~~~~~~~~~~ TEST_PASS ~~~~~~~~~~~~~~~~~~~\n" +
 "~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n" +
 "~~~~~~~~~ #####     ##     ####    #### ~~~~~~~~~\n" +
@@ -542,10 +3433,23 @@ def main():
 "~~~~~~~~~ #       #    #  #    #  #    #~~~~~~~~~\n" +
 "~~~~~~~~~ #       #    #   ####    #### ~~~~~~~~~\n" +
 "~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\033[0m\n")
-            else:
-                for errDir in errorList:
-                    logging.error(errDir)
-                logging.critical("\n" + "\033[0;31m"
+        else:
+            for result in results:
+                if result["status"] not in ("PASS", "SKIP"):
+                    errDir = result["dir"] or "%s_%s" % (result["test"], result["seed"])
+                    if result["status"] != "FAIL":
+                        errDir += " " + result["status"]
+                    logging.error(errDir + (", waves in %s" % result["waves"] if "waves" in result else ""))
+            buckets = {}
+            with tracer.span("triage"):
+                triageFailures(results, buckets)
+            logging.error("%d failures in %d signatures:" % (len(errorList), len(buckets)))
+            for signature, bucket in sorted(buckets.items(), key=lambda item: -item[1]["count"]):
+                repro = bucket["repro"]
+                logging.error("[%d] %s" % (bucket["count"], signature))
+                logging.error("    tests: %s" % ", ".join("%s(%d)" % item for item in bucket["tests"].most_common()))
+                logging.error("    repro: %s seed %s, %s" % (repro["test"], repro["seed"], repro["dir"]))
+            logging.critical("\n" + "\033[0;31m"
 "~~~~~~~~~~~~~~~~~~~ TEST_FAIL ~~~~~~~~~~~~~~~~~~~~\n" +
 "~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n" +
 "~~~~~~~~~~######    ##       #    #     ~~~~~~~~~~\n" +
@@ -556,6 +3460,131 @@ def main():
 "~~~~~~~~~~#       #    #     #    ######~~~~~~~~~~\n" +
 "~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\033[0m\n")
 
+
+def main():
+    """
+    This is the main program.
+    """
+    try:
+        builds = collections.OrderedDict()
+        testList = []
+        matchedList = []
+
+        cwd = os.getcwd()
+        FORMAT = "%(asctime)-15s %(levelname)s: %(message)s"
+        logging.basicConfig(format=FORMAT,level=logging.INFO)
+        args = parseArgs(cwd)
+        logging.info("Starting to run VCS script in directory: %s" % cwd)
+        logging.info("Output directory is %s" % os.path.expandvars(args.o))
+        if args.daemon:
+            vrunDaemon(args.sock or daemonSock, {"licenses": args.lic, "mem": args.mem or hostMemory(),
+                                                 "cpus": args.cpus}, args.watch).serve()
+            return
+        if args.merge is not None:
+            results = []
+            mergeShards(args.merge, results)
+            reportResults(results)
+            return
+        if args.clean and args.query is None:
+            cleanOutput(args.o, compileOutputs + historyOutputs)
+        outputDir = os.path.abspath(createOutput(args.o, False))
+        runId = datetime.datetime.now().strftime("%Y%m%d_%H%M%S") + "_%d" % os.getpid()
+        db = resultsDB(args.db or outputDir+"/vrun.db", runId)
+        if args.query is not None:
+            header, rows = db.query(args.query, time.time() - args.days * 86400, args.test)
+            logging.info(" | ".join(header))
+            for row in rows:
+                logging.info(" | ".join(str(col) for col in row))
+            logging.info("%d rows" % len(rows))
+            return
+
+        if args.profile:
+            atexit.register(tracer.export, os.path.abspath(args.profile))
+        manifest = runManifest(outputDir+"/"+manifestFile)
+        if args.resume or args.rerun:
+            manifest.load()
+            restoreCompileFlags(args, manifest.info)
+        with tracer.span("loadConfig"):
+            loadConfig(args, args.cfg, builds, testList)
+        if args.st:
+            testNum = 0
+            logging.info("The tests that can be executed are:")
+            for entry in testList:
+                logging.info("%d: %s"%(testNum, entry["test"]))
+                testNum += 1
+
+        jobList = []
+        if args.resume or args.rerun:
+            if manifest.info.get("cfg") != os.path.abspath(args.cfg):
+                logging.warning("The run was planned with config %s." % manifest.info.get("cfg"))
+            manifest.select(failStatuses if args.rerun else ("PENDING", "SKIP"), jobList)
+            logging.info("%s: %d jobs of run %s are going to be processed." %
+                         ("Rerun failed" if args.rerun else "Resume", len(jobList), manifest.info.get("run_id")))
+        else:
+            plan = readShardPlan(args) if args.shard is not None else None
+            if plan is None:
+                if args.rseed is None:
+                    args.rseed = random.getrandbits(31)
+                logging.info("Regression seed is %d, '-rseed %d' draws the same seeds again." % (args.rseed, args.rseed))
+                seeds = seedGen(args.rseed)
+                with tracer.span("extractTest"):
+                    extractTest(args, testList, matchedList, seeds)
+                logging.info("Tests that is going to be processed are:")
+                for test in matchedList:
+                    logging.info(test)
+                expandJobs(matchedList, jobList, seeds)
+            if args.shard is not None and plan is None:
+                # Shards of this regression run before mustn't change the split
+                scheduleJobs(args, jobList, db, "regr%d_shard%%" % args.rseed)
+                digest, loads = shardJobs(jobList, args.shard[1])
+                if writeShardPlan(args, jobList, digest, loads):
+                    logging.info("Wrote the shard plan %s." % args.shardplan)
+                else:
+                    logging.info("Another shard wrote the shard plan %s first, using it." % args.shardplan)
+                    plan = readShardPlan(args)
+            if plan is not None:
+                args.rseed = plan["rseed"]
+                digest, loads, jobList = plan["plan"], plan["loads"], plan["jobs"]
+                logging.info("Using the shard plan %s of regression seed %d." % (args.shardplan, args.rseed))
+            if args.shard is not None:
+                runId = "regr%d_shard%dof%d_%s" % (args.rseed, args.shard[0], args.shard[1], runId)
+                db.runId = runId
+                shardList = [job for job in jobList if job["shard"] == args.shard[0]]
+                logging.info("Shard %d/%d: %d of %d jobs, %.1fs of simulation, shards from %.1fs to %.1fs." %
+                             (args.shard[0], args.shard[1], len(shardList), len(jobList), loads[args.shard[0] - 1],
+                              min(loads), max(loads)))
+                shardInfo = {"shard": args.shard[0], "shards": args.shard[1], "plan": digest, "jobs": len(jobList)}
+                jobList = shardList
+
+        if args.plan:
+            scheduleJobs(args, jobList, db)
+            for job in jobList:
+                logging.info("%8.1fs  %s_%s" % (job["estimate"], job["test"], job["seed"]))
+            totalTime = sum(job["estimate"] for job in jobList)
+            logging.info("%d jobs, %.1fs of simulation, predicted makespan with %d jobs: %.1fs" %
+                         (len(jobList), totalTime, args.jobs, planMakespan(jobList, args.jobs)))
+            return
+
+        listeners = [db.record]
+        if jobList and not args.co:
+            if not (args.resume or args.rerun):
+                info = {"run_id": runId, "cfg": os.path.abspath(args.cfg), "created": time.time(),
+                        "regr_seed": args.rseed, "compile": {flag: getattr(args, flag) for flag in compileFlags}}
+                if args.shard is not None:
+                    info.update(shardInfo)
+                manifest.plan(jobList, info)
+            listeners.append(manifest.update)
+        try:
+            results = processVCS(args, builds, jobList, outputDir, listeners, db)
+        finally:
+            runTrash.flush()
+            if manifest.entries:
+                manifest.flush()
+        if manifest.entries:
+            logging.info("Run %s: %s" % (manifest.info.get("run_id"),
+                                         ", ".join("%d %s" % (cnt, status) for status, cnt in sorted(manifest.counts().items()))))
+        reportResults(results)
+
     except KeyboardInterrupt:
         logging.info("\nExited Ctrl+C from user request.")
         raise KeyboardInterrupt("<Keyboard Error> Exited Ctrl+C from user request.")